@@ -1,14 +1,22 @@
 # Python imports
+import functools
 import json
 import logging
 import os
+import re
 import socket
+import threading
 import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from io import open
 
 # Third party imports
+import cachetools
+import google.auth
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
@@ -21,6 +29,41 @@ from constants import bq_utils as bq_consts
 
 socket.setdefaulttimeout(bq_consts.SOCKET_TIMEOUT)
 
+# (project_id, dataset_id, table_id) -> table resource of an existing table
+_TABLE_INFO_CACHE = cachetools.TTLCache(
+    maxsize=bq_consts.TABLE_INFO_CACHE_MAXSIZE,
+    ttl=bq_consts.TABLE_INFO_CACHE_TTL)
+_TABLE_INFO_LOCK = threading.RLock()
+
+# statements which may change tables other than the destination of the query
+_TABLE_WRITE_STATEMENT = re.compile(
+    r'\b(CREATE|DROP|ALTER|TRUNCATE|INSERT|UPDATE|DELETE|MERGE)\b',
+    re.IGNORECASE)
+
+# per-thread storage for API clients, since the httplib2 transport is not thread-safe
+_thread_store = threading.local()
+
+# shared by all calls to wait_on_jobs so worker threads reuse their API clients
+_POLL_POOL = ThreadPoolExecutor(max_workers=bq_consts.JOB_WAIT_MAX_WORKERS)
+
+# waits on the results of query_async jobs, separate from _POLL_POOL so that
+# outstanding queries never hold up wait_on_jobs
+_QUERY_RESULTS_POOL = ThreadPoolExecutor(
+    max_workers=bq_consts.QUERY_RESULTS_MAX_WORKERS)
+
+# shared by all result iterations so worker threads reuse their API clients,
+# separate from _POLL_POOL so fetching pages never waits behind job polls
+_PAGE_POOL = ThreadPoolExecutor(max_workers=bq_consts.PAGE_PREFETCH_MAX_WORKERS)
+
+_PII_TABLES = frozenset(common.PII_TABLES)
+
+# load configuration shared by all csv load jobs, see load_csv
+_CSV_LOAD_CONFIG = {
+    'skipLeadingRows': 1,
+    'allowQuotedNewlines': True,
+    'sourceFormat': 'CSV'
+}
+
 
 class InvalidOperationError(RuntimeError):
     """Raised when an invalid Big Query operation attempted during the validation process"""
@@ -130,7 +173,31 @@ def get_validation_results_dataset_id():
 
 
 def create_service():
-    return build('bigquery', 'v2', cache={})
+    """
+    Get a BigQuery API client for the current thread
+
+    Building a client fetches and parses the discovery document, so it is done
+    once per thread and the client is reused by subsequent calls. The client
+    keeps its own persistent HTTP connection, so calls made by the thread
+    reuse it instead of opening a new connection each time.
+
+    :return: BigQuery API client
+    """
+    bq_service = getattr(_thread_store, 'bq_service', None)
+    if bq_service is None:
+        credentials, _ = google.auth.default(scopes=bq_consts.BQ_SCOPES)
+        http = AuthorizedHttp(credentials, http=httplib2.Http())
+        bq_service = build('bigquery', 'v2', http=http, cache={})
+        _thread_store.bq_service = bq_service
+    return bq_service
+
+
+@cachetools.cached(cache={})
+def _cdm_tables():
+    """
+    Get the names of the CDM tables as a set, for fast membership checks
+    """
+    return frozenset(resources.CDM_TABLES)
 
 
 def get_table_id(hpo_id, table_name):
@@ -146,26 +213,148 @@ def get_table_id(hpo_id, table_name):
     return hpo_id + '_' + table_name
 
 
-def get_table_info(table_id, dataset_id=None, project_id=None):
+def _table_info_key(table_id, dataset_id=None, project_id=None):
     """
-    Get metadata describing a table
+    Get the key identifying a table in the table info cache
 
     :param table_id: ID of the table
     :param dataset_id: ID of the dataset containing the table (EHR dataset by default)
     :param project_id: associated project ID (default app ID by default)
-    :return:
+    :return: tuple of (project_id, dataset_id, table_id)
     """
-    bq_service = create_service()
     if project_id is None:
         project_id = app_identity.get_application_id()
     if dataset_id is None:
         dataset_id = get_dataset_id()
+    return project_id, dataset_id, table_id
+
+
+def invalidate_table_info(table_id, dataset_id=None, project_id=None):
+    """
+    Remove any cached metadata for a table
+
+    Must be called whenever a table is created, deleted or overwritten.
+
+    :param table_id: ID of the table
+    :param dataset_id: ID of the dataset containing the table (EHR dataset by default)
+    :param project_id: associated project ID (default app ID by default)
+    """
+    key = _table_info_key(table_id, dataset_id, project_id)
+    with _TABLE_INFO_LOCK:
+        _TABLE_INFO_CACHE.pop(key, None)
+
+
+def invalidate_dataset_table_info(dataset_id, project_id=None):
+    """
+    Remove any cached metadata for the tables of a dataset
+
+    Must be called whenever a dataset is created, deleted or overwritten.
+
+    :param dataset_id: ID of the dataset
+    :param project_id: associated project ID (default app ID by default)
+    """
+    if project_id is None:
+        project_id = app_identity.get_application_id()
+    with _TABLE_INFO_LOCK:
+        keys = [
+            key for key in _TABLE_INFO_CACHE
+            if key[:2] == (project_id, dataset_id)
+        ]
+        for key in keys:
+            _TABLE_INFO_CACHE.pop(key, None)
+
+
+def _invalidate_job_tables(job):
+    """
+    Remove any cached metadata for the tables a finished job may have changed
+
+    Queries which may write to tables they do not name as destination (DDL,
+    DML and scripts) clear the whole cache, as do jobs whose resource is
+    unknown.
+
+    :param job: the job resource, or None if it could not be retrieved
+    """
+    configuration = job.get('configuration', {}) if job else {}
+    query_config = configuration.get('query', {})
+    if job is None or _TABLE_WRITE_STATEMENT.search(
+            query_config.get('query', '')):
+        with _TABLE_INFO_LOCK:
+            _TABLE_INFO_CACHE.clear()
+        return
+    for job_type in ('load', 'query', 'copy'):
+        table_ref = configuration.get(job_type, {}).get('destinationTable')
+        if table_ref:
+            invalidate_table_info(table_ref['tableId'], table_ref['datasetId'],
+                                  table_ref['projectId'])
+
+
+def _get_table_info_uncached(project_id, dataset_id, table_id):
+    """
+    Get metadata describing a table directly from the API
+
+    :param project_id: associated project ID
+    :param dataset_id: ID of the dataset containing the table
+    :param table_id: ID of the table
+    :return: the table resource
+    """
+    bq_service = create_service()
     job = bq_service.tables().get(projectId=project_id,
                                   datasetId=dataset_id,
                                   tableId=table_id)
     return job.execute(num_retries=bq_consts.BQ_DEFAULT_RETRY_COUNT)
 
 
+def _get_cached_table_info(key):
+    """
+    Get metadata describing a table from the cache, or the API on a cache miss
+
+    Tables which do not exist are not cached, since they may be created at
+    any time.
+
+    :param key: tuple of (project_id, dataset_id, table_id)
+    :return: the table resource, or None if the table does not exist
+    """
+    with _TABLE_INFO_LOCK:
+        table_info = _TABLE_INFO_CACHE.get(key)
+    if table_info is not None:
+        return table_info
+    try:
+        table_info = _get_table_info_uncached(*key)
+    except HttpError as err:
+        if err.resp.status != 404:
+            raise
+        return None
+    with _TABLE_INFO_LOCK:
+        _TABLE_INFO_CACHE[key] = table_info
+    return table_info
+
+
+def get_table_info(table_id, dataset_id=None, project_id=None):
+    """
+    Get metadata describing a table
+
+    Results are cached for `TABLE_INFO_CACHE_TTL` seconds. `HttpError` is
+    raised if the table does not exist.
+
+    Tables changed by jobs started and waited on through this module are
+    invalidated. Other writes (e.g. through the google-cloud client) must call
+    `invalidate_table_info` or `invalidate_dataset_table_info`.
+
+    :param table_id: ID of the table
+    :param dataset_id: ID of the dataset containing the table (EHR dataset by default)
+    :param project_id: associated project ID (default app ID by default)
+    :return:
+    """
+    key = _table_info_key(table_id, dataset_id, project_id)
+    with _TABLE_INFO_LOCK:
+        table_info = _TABLE_INFO_CACHE.get(key)
+    if table_info is None:
+        table_info = _get_table_info_uncached(*key)
+        with _TABLE_INFO_LOCK:
+            _TABLE_INFO_CACHE[key] = table_info
+    return table_info
+
+
 def load_csv(table_name,
              gcs_object_path,
              project_id,
@@ -188,7 +377,8 @@ def load_csv(table_name,
     bq_service = create_service()
 
     fields = resources.fields_for(table_name)
-    load = {
+    load = dict(_CSV_LOAD_CONFIG)
+    load.update({
         'sourceUris': [gcs_object_path],
         bq_consts.SCHEMA: {
             bq_consts.FIELDS: fields
@@ -198,16 +388,15 @@ def load_csv(table_name,
             'datasetId': dataset_id,
             'tableId': table_id
         },
-        'skipLeadingRows': 1,
-        'allowQuotedNewlines': True,
         'writeDisposition': write_disposition,
-        'allowJaggedRows': allow_jagged_rows,
-        'sourceFormat': 'CSV'
-    }
+        'allowJaggedRows': allow_jagged_rows
+    })
     job_body = {'configuration': {'load': load}}
     insert_job = bq_service.jobs().insert(projectId=project_id, body=job_body)
     insert_result = insert_job.execute(
         num_retries=bq_consts.BQ_DEFAULT_RETRY_COUNT)
+    # the table is invalidated again once the job is seen to finish
+    invalidate_table_info(table_id, dataset_id, project_id)
     return insert_result
 
 
@@ -221,7 +410,7 @@ def load_cdm_csv(hpo_id,
     :param cdm_table_name: name of the CDM table
     :return: an object describing the associated bigquery job
     """
-    if cdm_table_name not in resources.CDM_TABLES:
+    if cdm_table_name not in _cdm_tables():
         raise ValueError(
             '{} is not a valid table to load'.format(cdm_table_name))
 
@@ -248,7 +437,7 @@ def load_pii_csv(hpo_id, pii_table_name, source_folder_prefix=""):
     :param pii_table_name: name of the CDM table
     :return: an object describing the associated bigquery job
     """
-    if pii_table_name not in common.PII_TABLES:
+    if pii_table_name not in _PII_TABLES:
         raise ValueError(
             '{} is not a valid table to load'.format(pii_table_name))
 
@@ -292,7 +481,9 @@ def delete_table(table_id, dataset_id=None):
                                             datasetId=dataset_id,
                                             tableId=table_id)
     logging.info(f"Deleting {dataset_id}.{table_id}")
-    return delete_job.execute(num_retries=bq_consts.BQ_DEFAULT_RETRY_COUNT)
+    result = delete_job.execute(num_retries=bq_consts.BQ_DEFAULT_RETRY_COUNT)
+    invalidate_table_info(table_id, dataset_id, app_id)
+    return result
 
 
 def table_exists(table_id, dataset_id=None):
@@ -301,31 +492,38 @@ def table_exists(table_id, dataset_id=None):
     :param table_id: id of the table
     :return: `True` if the table exists, `False` otherwise
     """
-    app_id = app_identity.get_application_id()
-    if dataset_id is None:
-        dataset_id = get_dataset_id()
-    bq_service = create_service()
-    try:
-        bq_service.tables().get(
-            projectId=app_id, datasetId=dataset_id, tableId=table_id).execute(
-                num_retries=bq_consts.BQ_DEFAULT_RETRY_COUNT)
-        return True
-    except HttpError as err:
-        if err.resp.status != 404:
-            raise
-        return False
+    key = _table_info_key(table_id, dataset_id)
+    return _get_cached_table_info(key) is not None
 
 
 def job_status_done(job_id):
     """
     Check if the job is complete
-    
+
+    Transient server errors are retried with a linear backoff, so polling
+    survives them.
+
     :param job_id: the job id
     :return: a bool indicating whether the job is done
     """
-    job_details = get_job_details(job_id)
+    retries = 0
+    while True:
+        try:
+            job_details = get_job_details(job_id)
+            break
+        except HttpError as err:
+            if (err.resp.status not in bq_consts.JOB_STATUS_RETRY_STATUSES or
+                    retries >= bq_consts.JOB_STATUS_MAX_RETRIES):
+                raise
+            retries += 1
+            logging.warning(
+                f'Retrying status check of job {job_id} after error: {err}')
+            sleeper(retries)
     job_running_status = job_details['status']['state']
-    return job_running_status == 'DONE'
+    if job_running_status == 'DONE':
+        _invalidate_job_tables(job_details)
+        return True
+    return False
 
 
 def job_status_errored(job_id):
@@ -353,25 +551,119 @@ def sleeper(poll_interval):
     return
 
 
-def wait_on_jobs(job_ids, retry_count=bq_consts.BQ_DEFAULT_RETRY_COUNT):
+def _wait_one(job_id,
+              timeout_ms=bq_consts.JOB_WAIT_TIMEOUT_MS,
+              project_id=None):
+    """
+    Wait up to `timeout_ms` for a job to complete
+
+    Uses jobs.getQueryResults, which blocks server-side and returns as soon as
+    the job completes. Jobs whose results cannot be fetched (e.g. load jobs or
+    failed queries) are checked with jobs.get instead.
+
+    :param job_id: the job id
+    :param timeout_ms: how long the server may wait for the job to complete
+    :param project_id: associated project ID (default app ID by default)
+    :return: a bool indicating whether the job is done
+    """
+    bq_service = create_service()
+    app_id = project_id or app_identity.get_application_id()
+    try:
+        response = bq_service.jobs().getQueryResults(
+            projectId=app_id, jobId=job_id, timeoutMs=timeout_ms,
+            maxResults=0).execute(num_retries=bq_consts.BQ_DEFAULT_RETRY_COUNT)
+    except HttpError as err:
+        if err.resp.status >= 500:
+            raise
+        return job_status_done(job_id)
+    return response.get('jobComplete', False)
+
+
+def _get_jobs(job_ids, project_id=None):
+    """
+    Get the job resources for several jobs using batch requests
+
+    Jobs whose resource could not be retrieved are logged and left out.
+
+    :param job_ids: list of job_id strings
+    :param project_id: associated project ID (default app ID by default)
+    :return: dict mapping job_id -> job resource (for details see https://goo.gl/bUE49Z)
     """
-    Implements exponential backoff to wait for jobs to complete
+    bq_service = create_service()
+    app_id = project_id or app_identity.get_application_id()
+    jobs = {}
+
+    def add_job(request_id, response, exception):
+        job_id = job_ids[int(request_id)]
+        if exception is None:
+            jobs[job_id] = response
+        else:
+            logging.warning(
+                f'Unable to get status of job {job_id}: {exception}')
+
+    max_calls = bq_consts.BATCH_REQUEST_MAX_CALLS
+    for start in range(0, len(job_ids), max_calls):
+        batch = bq_service.new_batch_http_request(callback=add_job)
+        for index in range(start, min(start + max_calls, len(job_ids))):
+            batch.add(bq_service.jobs().get(projectId=app_id,
+                                            jobId=job_ids[index]),
+                      request_id=str(index))
+        batch.execute()
+    return jobs
+
+
+def wait_on_jobs(job_ids,
+                 retry_count=bq_consts.BQ_DEFAULT_RETRY_COUNT,
+                 timeout_ms=bq_consts.JOB_WAIT_TIMEOUT_MS):
+    """
+    Wait for jobs to complete
+
+    Each round gets the status of all pending jobs in a single batch request,
+    then long-polls the query jobs still running concurrently on a shared
+    thread pool. The first round starts right away, each further round after
+    an exponential backoff, which is only needed for jobs that cannot be
+    long-polled (see `_wait_one`).
+
     :param job_ids: list of job_id strings
-    :param retry_count: max number of iterations for exponent
+    :param retry_count: max number of backoffs before the jobs are checked again
+    :param timeout_ms: how long each long-poll may wait for a job to complete
     :return: list of jobs that failed to complete or empty list if all completed
     """
     job_ids = list(job_ids)
+    if not job_ids:
+        return job_ids
+    app_id = app_identity.get_application_id()
+    wait_one = functools.partial(_wait_one,
+                                 timeout_ms=timeout_ms,
+                                 project_id=app_id)
     poll_interval = 1
-    for _ in range(retry_count):
-        logging.info(
-            f'Waiting {poll_interval} seconds for completion of job(s): {job_ids}'
-        )
-        sleeper(poll_interval)
-        job_ids = [job_id for job_id in job_ids if not job_status_done(job_id)]
+    for attempt in range(retry_count + 1):
+        if attempt:
+            logging.info(
+                f'Waiting {poll_interval} seconds for completion of job(s): {job_ids}'
+            )
+            sleeper(poll_interval)
+            poll_interval = min(bq_consts.MAX_POLL_INTERVAL, poll_interval * 2)
+        jobs = _get_jobs(job_ids, app_id)
+        done_ids = {
+            job_id for job_id in job_ids
+            if job_id in jobs and jobs[job_id]['status']['state'] == 'DONE'
+        }
+        # load and extract jobs cannot be long-polled
+        poll_ids = [
+            job_id for job_id in job_ids if job_id not in done_ids and
+            (job_id not in jobs or
+             'query' in jobs[job_id].get('configuration', {}))
+        ]
+        if poll_ids:
+            done = _POLL_POOL.map(wait_one, poll_ids)
+            done_ids.update(
+                job_id for job_id, is_done in zip(poll_ids, done) if is_done)
+        for job_id in done_ids:
+            _invalidate_job_tables(jobs.get(job_id))
+        job_ids = [job_id for job_id in job_ids if job_id not in done_ids]
         if not job_ids:
             return job_ids
-        if poll_interval < bq_consts.MAX_POLL_INTERVAL:
-            poll_interval *= 2
     logging.info(f'Job(s) {job_ids} failed to complete')
     return job_ids
 
@@ -395,7 +687,8 @@ def query(q,
           write_disposition=bq_consts.WRITE_EMPTY,
           destination_dataset_id=None,
           batch=None,
-          dry_run=False):
+          dry_run=False,
+          timeout_ms=bq_consts.SOCKET_TIMEOUT):
     """
     Execute a SQL query on BigQuery dataset
 
@@ -408,6 +701,8 @@ def query(q,
     :param batch: whether the query should be run in INTERACTIVE or BATCH mode.
         Defaults to INTERACTIVE.
     :param dry_run: Boolean. If true, validates query without running it. Helps with testing
+    :param timeout_ms: how long to wait for the query to complete when destination_table_id
+        is not supplied
     :return: if destination_table_id is supplied then job info, otherwise job query response
              (see https://goo.gl/AoGY6P and https://goo.gl/bQ7o2t)
     """
@@ -437,8 +732,12 @@ def query(q,
                 }
             }
         }
-        return bq_service.jobs().insert(
+        insert_result = bq_service.jobs().insert(
             projectId=app_id, body=job_body).execute(num_retries=retry_count)
+        # the table is invalidated again once the job is seen to finish
+        invalidate_table_info(destination_table_id, destination_dataset_id,
+                              app_id)
+        return insert_result
     else:
         job_body = {
             'defaultDataset': {
@@ -446,13 +745,117 @@ def query(q,
                 'datasetId': get_dataset_id()
             },
             'query': q,
-            'timeoutMs': bq_consts.SOCKET_TIMEOUT,
+            'timeoutMs': timeout_ms,
             'useLegacySql': use_legacy_sql,
             'dryRun': dry_run,
             bq_consts.PRIORITY_TAG: priority_mode,
         }
-        return bq_service.jobs().query(
+        response = bq_service.jobs().query(
             projectId=app_id, body=job_body).execute(num_retries=retry_count)
+        if not dry_run:
+            # a query still running is invalidated again if waited on
+            _invalidate_job_tables({'configuration': {'query': job_body}})
+        return response
+
+
+def _get_query_results(job_id,
+                       timeout_ms=bq_consts.JOB_WAIT_TIMEOUT_MS,
+                       query_config=None,
+                       max_wait_ms=bq_consts.QUERY_RESULTS_MAX_WAIT_MS):
+    """
+    Wait for a query job to complete and get the first page of its results
+
+    :param job_id: id of the query job
+    :param timeout_ms: how long each request may wait for the job to complete
+    :param query_config: query configuration of the job, used to invalidate the
+        metadata of the tables it may have changed
+    :param max_wait_ms: how long to wait for the job to complete overall
+    :return: the query results response (see https://goo.gl/bQ7o2t)
+    :raises BigQueryJobWaitError: if the job does not complete in `max_wait_ms`
+    """
+    bq_service = create_service()
+    app_id = app_identity.get_application_id()
+    deadline = time.monotonic() + max_wait_ms / 1000
+    try:
+        while True:
+            remaining_ms = int((deadline - time.monotonic()) * 1000)
+            if remaining_ms <= 0:
+                raise BigQueryJobWaitError([job_id],
+                                           f'no results after {max_wait_ms} ms')
+            response = bq_service.jobs().getQueryResults(
+                projectId=app_id,
+                jobId=job_id,
+                timeoutMs=min(timeout_ms, remaining_ms)).execute(
+                    num_retries=bq_consts.BQ_DEFAULT_RETRY_COUNT)
+            if response.get('jobComplete', False):
+                return response
+    finally:
+        # a failed job may still have changed some tables
+        _invalidate_job_tables({'configuration': {'query': query_config or {}}})
+
+
+def query_async(q,
+                use_legacy_sql=False,
+                destination_table_id=None,
+                retry_count=bq_consts.BQ_DEFAULT_RETRY_COUNT,
+                write_disposition=bq_consts.WRITE_EMPTY,
+                destination_dataset_id=None,
+                batch=None,
+                timeout_ms=bq_consts.JOB_WAIT_TIMEOUT_MS,
+                max_wait_ms=bq_consts.QUERY_RESULTS_MAX_WAIT_MS):
+    """
+    Start a SQL query job on BigQuery dataset without waiting for it to complete
+
+    Allows several independent queries to run concurrently.
+
+    :param q: SQL statement
+    :param use_legacy_sql: True if using legacy syntax, False by default
+    :param destination_table_id: if set, output is saved in a table with the specified id
+    :param retry_count: number of times to retry with randomized exponential backoff
+    :param write_disposition: WRITE_TRUNCATE, WRITE_APPEND or WRITE_EMPTY (default)
+    :param destination_dataset_id: dataset ID of destination table (EHR dataset by default)
+    :param batch: whether the query should be run in INTERACTIVE or BATCH mode.
+        Defaults to INTERACTIVE.
+    :param timeout_ms: how long each request for the results may wait for the job to complete
+    :param max_wait_ms: how long to wait for the results overall, after which
+        the future raises `BigQueryJobWaitError`
+    :return: tuple of the job id and a `concurrent.futures.Future` resolving to the
+        query results response (see https://goo.gl/bQ7o2t)
+    """
+    bq_service = create_service()
+    app_id = app_identity.get_application_id()
+
+    priority_mode = bq_consts.INTERACTIVE if batch is None else bq_consts.BATCH
+
+    query_config = {
+        'query': q,
+        'useLegacySql': use_legacy_sql,
+        'defaultDataset': {
+            'projectId': app_id,
+            'datasetId': get_dataset_id()
+        },
+        bq_consts.PRIORITY_TAG: priority_mode
+    }
+    if destination_table_id:
+        if destination_dataset_id is None:
+            destination_dataset_id = get_dataset_id()
+        query_config['destinationTable'] = {
+            'projectId': app_id,
+            'datasetId': destination_dataset_id,
+            'tableId': destination_table_id
+        }
+        query_config['writeDisposition'] = write_disposition
+    job_body = {'configuration': {'query': query_config}}
+    insert_result = bq_service.jobs().insert(
+        projectId=app_id, body=job_body).execute(num_retries=retry_count)
+    if destination_table_id:
+        invalidate_table_info(destination_table_id, destination_dataset_id,
+                              app_id)
+
+    job_id = insert_result[bq_consts.JOB_REFERENCE][bq_consts.JOB_ID]
+    return job_id, _QUERY_RESULTS_POOL.submit(_get_query_results, job_id,
+                                              timeout_ms, query_config,
+                                              max_wait_ms)
 
 
 def create_table(table_id, fields, drop_existing=False, dataset_id=None):
@@ -491,7 +894,10 @@ def create_table(table_id, fields, drop_existing=False, dataset_id=None):
     insert_job = bq_service.tables().insert(projectId=app_id,
                                             datasetId=dataset_id,
                                             body=insert_body)
-    return insert_job.execute(num_retries=bq_consts.BQ_DEFAULT_RETRY_COUNT)
+    insert_result = insert_job.execute(
+        num_retries=bq_consts.BQ_DEFAULT_RETRY_COUNT)
+    invalidate_table_info(table_id, dataset_id, app_id)
+    return insert_result
 
 
 def create_standard_table(table_name,
@@ -536,23 +942,32 @@ def list_tables(dataset_id=None,
         PendingDeprecationWarning,
         stacklevel=2,
     )
+    return list(_iter_tables(dataset_id, max_results, project_id))
+
+
+def _iter_tables(dataset_id=None,
+                 max_results=bq_consts.LIST_TABLES_MAX_RESULTS,
+                 project_id=None):
+    """
+    Generate the tables in the dataset, one page of results at a time
+
+    :param dataset_id: dataset to list tables for (EHR dataset by default)
+    :param max_results: maximum number of results to return per page
+    :param project_id: associated project ID (default app ID by default)
+    :return: generator of objects with the structure described at https://goo.gl/Z17MWs
+    """
     bq_service = create_service()
     if project_id is None:
-        app_id = app_identity.get_application_id()
-    else:
-        app_id = project_id
+        project_id = app_identity.get_application_id()
     if dataset_id is None:
         dataset_id = get_dataset_id()
-    results = []
-    request = bq_service.tables().list(projectId=app_id,
+    request = bq_service.tables().list(projectId=project_id,
                                        datasetId=dataset_id,
                                        maxResults=max_results)
     while request is not None:
         response = request.execute(num_retries=bq_consts.BQ_DEFAULT_RETRY_COUNT)
-        tables = response.get('tables', [])
-        results.extend(tables or [])
+        yield from response.get('tables') or []
         request = bq_service.tables().list_next(request, response)
-    return results
 
 
 def get_table_id_from_obj(table_obj):
@@ -560,16 +975,7 @@ def get_table_id_from_obj(table_obj):
 
 
 def list_dataset_contents(dataset_id):
-    project_id = app_identity.get_application_id()
-    service = create_service()
-    req = service.tables().list(projectId=project_id, datasetId=dataset_id)
-    all_tables = []
-    while req:
-        resp = req.execute()
-        items = [item['id'].split('.')[-1] for item in resp.get('tables', [])]
-        all_tables.extend(items or [])
-        req = service.tables().list_next(req, resp)
-    return all_tables
+    return [get_table_id_from_obj(table) for table in _iter_tables(dataset_id)]
 
 
 def list_datasets(project_id):
@@ -594,33 +1000,69 @@ def get_dataset_id_from_obj(dataset_obj):
     return dataset_obj['id'].split(':')[-1]
 
 
-def large_response_to_rowlist(query_response):
+def _get_query_results_page(project_id, job_id, page_token):
     """
-    Convert a query response to a list of dictionary objects
+    Get a page of query results
+
+    :param project_id: associated project ID
+    :param job_id: id of the query job
+    :param page_token: token identifying the page to get
+    :return: the query results page
+    """
+    bq_service = create_service()
+    return bq_service.jobs().getQueryResults(
+        projectId=project_id, jobId=job_id, pageToken=page_token).execute(
+            num_retries=bq_consts.BQ_DEFAULT_RETRY_COUNT)
 
-    This automatically uses the pageToken feature to iterate through a
-    large result set.  Use cautiously.
+
+def _iter_query_result_pages(query_response):
+    """
+    Generate the pages of a query response
+
+    Each page is fetched in the background while the caller processes the
+    previous one.
 
     :param query_response: the query response object to iterate
-    :return: list of dictionaries
+    :return: generator of query results pages, starting with `query_response`
     """
-    bq_service = create_service()
     app_id = app_identity.get_application_id()
-
-    page_token = query_response.get(bq_consts.PAGE_TOKEN)
     job_ref = query_response.get(bq_consts.JOB_REFERENCE)
     job_id = job_ref.get(bq_consts.JOB_ID)
 
-    result_list = response2rows(query_response)
-    while page_token:
-        next_grouping = bq_service.jobs() \
-            .getQueryResults(projectId=app_id, jobId=job_id, pageToken=page_token) \
-            .execute(num_retries=bq_consts.BQ_DEFAULT_RETRY_COUNT)
-        page_token = next_grouping.get(bq_consts.PAGE_TOKEN)
-        intermediate_rows = response2rows(next_grouping)
-        result_list.extend(intermediate_rows)
+    page = query_response
+    while page is not None:
+        page_token = page.get(bq_consts.PAGE_TOKEN)
+        next_page = _PAGE_POOL.submit(_get_query_results_page, app_id, job_id,
+                                      page_token) if page_token else None
+        yield page
+        page = next_page.result() if next_page else None
+
+
+def large_response_to_rows(query_response):
+    """
+    Generate dictionary objects from a query response
+
+    This automatically uses the pageToken feature to iterate through a
+    large result set, without holding the entire result set in memory.
+
+    :param query_response: the query response object to iterate
+    :return: generator of dictionaries
+    """
+    for page in _iter_query_result_pages(query_response):
+        yield from response2rows(page)
+
+
+def large_response_to_rowlist(query_response):
+    """
+    Convert a query response to a list of dictionary objects
+
+    This automatically uses the pageToken feature to iterate through a
+    large result set.  Use cautiously.
 
-    return result_list
+    :param query_response: the query response object to iterate
+    :return: list of dictionaries
+    """
+    return list(large_response_to_rows(query_response))
 
 
 def response2rows(r):
@@ -631,81 +1073,94 @@ def response2rows(r):
     :return: list of dict
     """
     rows = r.get(bq_consts.ROWS, [])
+    if not rows:
+        return []
     schema = r.get(bq_consts.SCHEMA, {bq_consts.FIELDS: None})[bq_consts.FIELDS]
-    return [_transform_row(row, schema) for row in rows]
-
-
-def _recurse_on_row(col_dict, nested_value):
-    """
-    Apply the schema specified by the given dict to the nested value by recursing on it.
+    decoders = _compile_schema(schema)
+    return [_transform_row(row, decoders) for row in rows]
 
-        :param col_dict: the schema to apply to the nested value.
-        :param nested_value: A value nested in a BigQuery row.
-        :returns: Union[dict, list] objects from applied schema.
-        """
 
-    row_value = None
+def _to_bool(value):
+    return value in ('True', 'true', 'TRUE')
 
-    # Multiple nested records
-    if col_dict['mode'] == 'REPEATED' and isinstance(nested_value, list):
-        row_value = [
-            _transform_row(record['v'], col_dict['fields'])
-            for record in nested_value
-        ]
 
-    # A single nested record
-    else:
-        row_value = _transform_row(nested_value, col_dict['fields'])
+def _identity(value):
+    return value
 
-    return row_value
 
+# functions casting BigQuery values by field type, values of other types are kept as is
+_TYPE_CASTS = {
+    'INTEGER': int,
+    'FLOAT': float,
+    'BOOLEAN': _to_bool,
+    'TIMESTAMP': float,
+}
 
-def _transform_row(row, schema):
-    """
-    Apply the given schema to the given BigQuery data row. Adapted from https://goo.gl/dWszQJ.
 
-    :param row: A single BigQuery row to transform
-    :param schema: The BigQuery table schema to apply to the row, specifically
-        the list of field dicts.
-    :returns: Row as a dict
+def _compile_schema(schema):
     """
+    Compile a BigQuery table schema into the decoders applied to each row.
 
-    log = {}
+    Resolving the field types once per schema avoids repeating the lookups for
+    every value of every row.
 
-    # Match each schema column with its associated row value
-    for index, col_dict in enumerate(schema):
-        col_name = col_dict['name']
-        row_value = row['f'][index]['v']
+    :param schema: The BigQuery table schema, specifically the list of field dicts.
+    :returns: list of (column name, function decoding a non-null value) tuples
+    """
+    decoders = []
+    for col_dict in schema:
+        if col_dict['type'] == 'RECORD':
+            decode = _compile_record(col_dict)
+        else:
+            decode = _TYPE_CASTS.get(col_dict['type'], _identity)
+        decoders.append((col_dict['name'], decode))
+    return decoders
 
-        if row_value is None:
-            log[col_name] = None
-            continue
 
-        # Recurse on nested records
-        if col_dict['type'] == 'RECORD':
-            row_value = _recurse_on_row(col_dict, row_value)
+def _compile_record(col_dict):
+    """
+    Compile the decoder for a nested record by recursing on its schema.
 
-        # Otherwise just cast the value
-        elif col_dict['type'] == 'INTEGER':
-            row_value = int(row_value)
+    :param col_dict: the schema of the nested record.
+    :returns: function decoding a nested value into Union[dict, list] objects
+    """
+    decoders = _compile_schema(col_dict['fields'])
+    repeated = col_dict.get('mode') == 'REPEATED'
 
-        elif col_dict['type'] == 'FLOAT':
-            row_value = float(row_value)
+    def decode(nested_value):
+        # Multiple nested records
+        if repeated and isinstance(nested_value, list):
+            return [
+                _transform_row(record['v'], decoders) for record in nested_value
+            ]
+        # A single nested record
+        return _transform_row(nested_value, decoders)
 
-        elif col_dict['type'] == 'BOOLEAN':
-            row_value = row_value in ('True', 'true', 'TRUE')
+    return decode
 
-        elif col_dict['type'] == 'TIMESTAMP':
-            row_value = float(row_value)
 
-        log[col_name] = row_value
+def _transform_row(row, decoders):
+    """
+    Apply the given schema to the given BigQuery data row. Adapted from https://goo.gl/dWszQJ.
 
+    :param row: A single BigQuery row to transform
+    :param decoders: The BigQuery table schema to apply to the row, as compiled
+        by `_compile_schema`.
+    :returns: Row as a dict
+    """
+    values = row['f']
+    log = {}
+    # Match each schema column with its associated row value
+    for index, (col_name, decode) in enumerate(decoders):
+        row_value = values[index]['v']
+        log[col_name] = None if row_value is None else decode(row_value)
     return log
 
 
 def list_all_table_ids(dataset_id=None):
-    tables = list_tables(dataset_id)
-    return [table['tableReference']['tableId'] for table in tables]
+    return [
+        table['tableReference']['tableId'] for table in _iter_tables(dataset_id)
+    ]
 
 
 def create_dataset(project_id=None,
@@ -771,6 +1226,7 @@ def create_dataset(project_id=None,
                     datasetId=dataset_id,
                     deleteContents=overwrite_existing)
                 rm_dataset.execute(num_retries=bq_consts.BQ_DEFAULT_RETRY_COUNT)
+                invalidate_dataset_table_info(dataset_id, app_id)
                 insert_result = insert_dataset.execute(
                     num_retries=bq_consts.BQ_DEFAULT_RETRY_COUNT)
                 logging.info(f"Overwrote dataset {app_id}.{dataset_id}")
@@ -790,6 +1246,8 @@ def create_dataset(project_id=None,
                               f"dataset: {app_id}.{dataset_id}")
             raise
 
+    # tables of the dataset may have been cached as missing before it existed
+    invalidate_dataset_table_info(dataset_id, app_id)
     return insert_result
 
 
@@ -811,7 +1269,7 @@ def csv_line_to_sql_row_expr(row: dict, fields: list):
     val_exprs = []
     # TODO refactor for all other types or use external library
     for field_name, val in row.items():
-        field = next(filter(lambda f: f['name'] == field_name, fields), None)
+        field = next((f for f in fields if f['name'] == field_name), None)
         if field is None:
             raise InvalidOperationError(
                 f'Unable to marshal {val}: field "{field_name}" was not found')
@@ -900,7 +1358,7 @@ def has_primary_key(table):
     :param table: name of a CDM table
     :return: True if the CDM table contains a primary key field, False otherwise
     """
-    if table not in resources.CDM_TABLES:
+    if table not in _cdm_tables():
         raise AssertionError()
     fields = resources.fields_for(table)
     id_field = table + '_id'
@@ -2,8 +2,29 @@
 SOCKET_TIMEOUT = 600000
 BQ_DEFAULT_RETRY_COUNT = 10
 MAX_POLL_INTERVAL = 500
+# Server-side wait used when long-polling a job with jobs.getQueryResults
+JOB_WAIT_TIMEOUT_MS = 10000
+JOB_WAIT_MAX_WORKERS = 16
+# Threads waiting on the results of query_async jobs, and how long they may wait
+QUERY_RESULTS_MAX_WORKERS = 16
+QUERY_RESULTS_MAX_WAIT_MS = 3600000
+# Threads prefetching the next page of large query results
+PAGE_PREFETCH_MAX_WORKERS = 4
+# Transient API errors retried when checking a job's status
+JOB_STATUS_RETRY_STATUSES = (500, 503)
+JOB_STATUS_MAX_RETRIES = 5
+# Maximum number of calls the API accepts in a single batch request
+BATCH_REQUEST_MAX_CALLS = 1000
 # Maximum results returned by list_tables (API has a low default value)
 LIST_TABLES_MAX_RESULTS = 10000
+# OAuth scopes of the BigQuery API client, cloud-platform allows loading from GCS
+BQ_SCOPES = [
+    'https://www.googleapis.com/auth/bigquery',
+    'https://www.googleapis.com/auth/cloud-platform'
+]
+# Table metadata cache used by get_table_info and table_exists
+TABLE_INFO_CACHE_MAXSIZE = 1024
+TABLE_INFO_CACHE_TTL = 300
 DATE_FORMAT = '%Y%m%d'
 BLANK = ''
 
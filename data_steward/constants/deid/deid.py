@@ -1 +1,4 @@
 MAX_AGE = 89
+
+# max number of simulation sample queries to run at once
+SIMULATE_MAX_WORKERS = 8
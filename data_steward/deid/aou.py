@@ -73,17 +73,15 @@ DESIGN:
                         debug       will just print output without simulation or submit (runs alone)
 """
 # Python imports
-import json
 import logging
 import os
-import time
-from copy import copy
+import re
 from datetime import datetime
 
 # Third party imports
-import numpy as np
 import pandas as pd
 from google.cloud import bigquery as bq
+from google.cloud.exceptions import NotFound
 from google.oauth2 import service_account
 
 # Project imports
@@ -97,6 +95,9 @@ from tools.concept_ids_suppression import get_all_concept_ids
 
 LOGGER = logging.getLogger(__name__)
 
+# column names with a date, time, or datetime part, e.g. visit_start_datetime
+_DATE_COL_RE = re.compile(r'(?:^|_)(?:date|time|datetime)(?:_|$)')
+
 
 def milliseconds_since_epoch():
     """
@@ -108,6 +109,44 @@ def milliseconds_since_epoch():
         (datetime.utcnow() - datetime(1970, 1, 1)).total_seconds() * 1000)
 
 
+def replace_in_rules(rules, placeholder, value):
+    """
+    Replace a placeholder in all the strings of a rule specification, in place
+
+    :param rules:  a rule specification, i.e. nested dicts and lists
+    :param placeholder:  the text to replace
+    :param value:  the replacement text
+    """
+    stack = [rules]
+    while stack:
+        node = stack.pop()
+        items = node.items() if isinstance(node, dict) else enumerate(node)
+        for key, item in items:
+            if isinstance(item, str):
+                node[key] = item.replace(placeholder, value)
+            elif isinstance(item, (dict, list)):
+                stack.append(item)
+
+
+def load_dataframe(client, data, table_id):
+    """
+    Replace a table's contents with a data-frame
+
+    Uses a single load job, which uploads the data-frame as parquet, instead of
+    streaming inserts.
+
+    :param client:  the bigquery client
+    :param data:  the data-frame to load
+    :param table_id:  the table to replace, as dataset.table
+    """
+    job_config = bq.LoadJobConfig()
+    job_config.write_disposition = bq_consts.WRITE_TRUNCATE
+    job = client.load_table_from_dataframe(data,
+                                           table_id,
+                                           job_config=job_config)
+    job.result()
+
+
 def create_person_id_src_hpo_map(input_dataset, credentials):
     """
     Create a table containing person_ids and src_hpo_ids
@@ -179,9 +218,12 @@ def create_person_id_src_hpo_map(input_dataset, credentials):
     LOGGER.info(f"Created mapping table:\t{input_dataset}.{map_tablename}")
 
 
-def create_allowed_states_table(input_dataset, credentials):
+def create_allowed_states_table(input_dataset, client):
     """
     Create a mapping table of src_hpos to states they are located in.
+
+    :param input_dataset: input dataset to save the mapping table to
+    :param client: bigquery client
     """
 
     map_tablename = input_dataset + "._mapping_src_hpos_to_allowed_states"
@@ -190,15 +232,15 @@ def create_allowed_states_table(input_dataset, credentials):
                      'src_hpos_to_allowed_states.csv'))
 
     # write this to bigquery.
-    data.to_gbq(map_tablename, credentials=credentials, if_exists='replace')
+    load_dataframe(client, data, map_tablename)
 
 
-def create_concept_id_lookup_table(input_dataset, credentials):
+def create_concept_id_lookup_table(input_dataset, client):
     """
     Create a lookup table of concept_id's to suppress
 
     :param input_dataset: input dataset to save lookup table to
-    :param credentials: bigquery credentials
+    :param client: bigquery client
     """
 
     lookup_tablename = input_dataset + "._concept_ids_suppression"
@@ -206,13 +248,12 @@ def create_concept_id_lookup_table(input_dataset, credentials):
         'vocabulary_id', 'concept_code', 'concept_name', 'concept_id',
         'domain_id', 'rule', 'question'
     ]
-    client = bq.Client(credentials=credentials)
 
     # use utility to get and append concept_ids from csv files and queries
     data = get_all_concept_ids(columns, input_dataset, client)
 
     # write this to bigquery.
-    data.to_gbq(lookup_tablename, credentials=credentials, if_exists='replace')
+    load_dataframe(client, data, lookup_tablename)
 
 
 class AOU(Press):
@@ -223,6 +264,8 @@ class AOU(Press):
         self.private_key = args.get('private_key', '')
         self.credentials = service_account.Credentials.from_service_account_file(
             self.private_key)
+        self.client = bq.Client(credentials=self.credentials,
+                                project=self.credentials.project_id)
         self.partition = args.get('cluster', False)
         self.priority = args.get('interactive', 'BATCH')
 
@@ -233,9 +276,7 @@ class AOU(Press):
             shift_days = (
                 f'SELECT shift from {self.idataset}._deid_map '
                 f'WHERE _deid_map.person_id = {self.tablename}.person_id')
-            self.deid_rules['shift'] = json.loads(
-                json.dumps(self.deid_rules['shift']).replace(
-                    ":SHIFT", shift_days))
+            replace_in_rules(self.deid_rules['shift'], ':SHIFT', shift_days)
 
     def initialize(self, **args):
         Press.initialize(self, **args)
@@ -244,17 +285,14 @@ class AOU(Press):
         age_limit = args.get('age_limit', MAX_AGE)
         LOGGER.info(f"Using participant age limit of {age_limit}")
 
-        million = 1000000
         map_tablename = self.idataset + "._deid_map"
 
-        map_table = pd.DataFrame()
-
         # Create concept_id lookup table for suppressions
-        create_concept_id_lookup_table(self.idataset, self.credentials)
+        create_concept_id_lookup_table(self.idataset, self.client)
 
         # only need to create these tables deidentifying the observation table
         if 'observation' in self.get_tablename().lower().split('.'):
-            create_allowed_states_table(self.idataset, self.credentials)
+            create_allowed_states_table(self.idataset, self.client)
             create_person_id_src_hpo_map(self.idataset, self.credentials)
 
         # ensure mapping table only contains participants within age limits
@@ -292,6 +330,15 @@ class AOU(Press):
     def get_dataframe(self, sql=None, limit=None, query_config=None):
         """
         This function will execute a query to a data-frame (for easy handling)
+
+        Results are downloaded with the BigQuery Storage API when it is
+        available, which is much faster than paging through tabledata.list.
+
+        :param sql: the query to run, defaults to selecting the whole table
+        :param limit: optional maximum number of rows to return
+        :param query_config: optional job configuration in API representation,
+            e.g. {'query': {'defaultDataset': {'datasetId': ...}}}
+        :return: a data-frame of the results, empty if the query failed
         """
         if sql is None:
             sql = ("SELECT * FROM {idataset}.{tablename}".format(
@@ -300,18 +347,15 @@ class AOU(Press):
         if limit:
             sql = sql + " LIMIT " + str(limit)
 
+        job_config = bq.QueryJobConfig.from_api_repr(
+            query_config) if query_config else bq.QueryJobConfig()
+        job_config.use_legacy_sql = False
+
         try:
-            if query_config:
-                df = pd.read_gbq(sql,
-                                 credentials=self.credentials,
-                                 dialect='standard',
-                                 configuration=query_config)
-            else:
-                df = pd.read_gbq(sql,
-                                 credentials=self.credentials,
-                                 dialect='standard')
-
-            return df
+            query_job = self.client.query(sql,
+                                          location='US',
+                                          job_config=job_config)
+            return query_job.result().to_dataframe(create_bqstorage_client=True)
         except Exception:
             LOGGER.exception(f"Unable to execute the query:\t{sql}")
 
@@ -351,40 +395,26 @@ class AOU(Press):
 
         :param columns: a list of column names for the given table
         """
-        date_columns = []
-        for name in columns:
-            for temporal in ['date', 'time', 'datetime']:
-                if temporal in name.split('_'):
-                    date_columns.append(name)
+        date_columns = [name for name in columns if _DATE_COL_RE.search(name)]
         #
         # shifting date attributes can be automatically done for relational fields
         # by looking at the field name of the data-type
         # @TODO: consider looking at the field name, changes might happen all of a sudden
         #
         if date_columns:
-            date = {}
-            datetime_field = {}
-
-            for name in date_columns:
-                # check covers 'datetime' fields by default,
-                # they already have 'time' in the name
-                if 'time' in name:
-                    if 'fields' not in datetime_field:
-                        datetime_field['fields'] = []
-                    datetime_field['fields'].append(name)
-                    datetime_field['rules'] = '@shift.datetime'
-                elif 'date' in name:
-                    if 'fields' not in date:
-                        date['fields'] = []
-
-                    date['fields'].append(name)
-                    date['rules'] = '@shift.date'
-            _toshift = []
+            # check covers 'datetime' fields by default,
+            # they already have 'time' in the name
+            datetime_fields = [name for name in date_columns if 'time' in name]
+            date_fields = [name for name in date_columns if 'time' not in name]
 
-            if date and datetime_field:
-                _toshift = [date, datetime_field]
-            elif date or datetime_field:
-                _toshift = [date] if date else [datetime_field]
+            _toshift = []
+            if date_fields:
+                _toshift.append({'fields': date_fields, 'rules': '@shift.date'})
+            if datetime_fields:
+                _toshift.append({
+                    'fields': datetime_fields,
+                    'rules': '@shift.datetime'
+                })
 
             if 'shift' not in self.table_info:
                 self.table_info['shift'] = []
@@ -475,20 +505,39 @@ class AOU(Press):
         """
         Submit the sql query to create a de-identified table.
 
+        Waits for the query to finish executing.
+
         :param sql:  The sql to send.
         :param create: a flag to identify if this query should create a new
             table or append to an existing table.
         :param dml:  boolean flag identifying if a statement is a dml statement
         """
+        job = self.submit_async(sql, create, dml=dml)
+        if job is not None:
+            self.wait(job)
+
+    def submit_async(self, sql, create, dml=None):
+        """
+        Submit the sql query to create a de-identified table, without waiting.
+
+        Each call builds its own job configuration, so statements which do not
+        depend on each other, e.g. appends to the output table, can be
+        submitted concurrently and waited on with `wait`.
+
+        :param sql:  The sql to send.
+        :param create: a flag to identify if this query should create a new
+            table or append to an existing table.
+        :param dml:  boolean flag identifying if a statement is a dml statement
+        :return:  the submitted QueryJob or None if the submission failed
+        """
         dml = False if dml is None else dml
         table_name = self.get_tablename()
-        client = bq.Client.from_service_account_json(self.private_key)
+        client = self.client
         #
         # Let's make sure the out dataset exists
-        datasets = list(client.list_datasets())
-        found = np.sum(
-            [1 for dataset in datasets if dataset.dataset_id == self.odataset])
-        if not found:
+        try:
+            client.get_dataset(self.odataset)
+        except NotFound:
             dataset = bq.Dataset(client.dataset(self.odataset))
             client.create_dataset(dataset)
 
@@ -506,9 +555,7 @@ class AOU(Press):
 
         job = bq.QueryJobConfig()
         job.priority = self.priority
-        job.dry_run = True
 
-        dml_job = None
         if not dml:
             job.destination = client.dataset(self.odataset).table(
                 self.tablename)
@@ -516,14 +563,13 @@ class AOU(Press):
             job.allow_large_results = True
             job.write_disposition = write_disposition
             if self.partition:
-                job._properties['timePartitioning'] = {'type': 'DAY'}
-                job._properties['clustering'] = {'field': 'person_id'}
-        else:
-            # create a copy of the job config to use if the dry-run passes
-            dml_job = copy(job)
+                # matches the partitioning of tables created by bq_utils
+                job.time_partitioning = bq.TimePartitioning(
+                    type_=bq.TimePartitioningType.DAY)
+                job.clustering_fields = ['person_id']
 
         LOGGER.info(
-            f"submitting a dry-run for:\t{self.get_tablename()}\t\tpriority:\t%s\t\tpartition:\t%s",
+            f"submitting query for:\t{self.get_tablename()}\t\tpriority:\t%s\t\tpartition:\t%s",
             self.priority, self.partition)
 
         logpath = os.path.join(self.logpath, self.idataset)
@@ -533,49 +579,35 @@ class AOU(Press):
             # log path already exists and we don't care
             pass
 
+        # errors in the query are surfaced when waiting on the job
         try:
             response = client.query(sql, location='US', job_config=job)
         except Exception:
-            LOGGER.exception(
-                f"dry run query failed for:\t{self.get_tablename()}\n"
-                f"\t\tSQL:\t{sql}\n"
-                f"\t\tjob config:\t{job}")
-        else:
-
-            if response.state == 'DONE':
-                if dml_job:
-                    job = dml_job
-
-                job.dry_run = False
-
-                LOGGER.info('dry-run passed.  submitting query for execution.')
+            LOGGER.exception(f"query failed for:\t{self.get_tablename()}\n"
+                             f"\t\tSQL:\t{sql}\n"
+                             f"\t\tjob config:\t{job}")
+            return None
 
-                response = client.query(sql, location='US', job_config=job)
-                LOGGER.info(
-                    f"submitted a bigquery job for table:\t{table_name}\t\t"
+        LOGGER.info(f"submitted a bigquery job for table:\t{table_name}\t\t"
                     f"status:\t'pending'\t\tvalue:\t{response.job_id}")
-                self.wait(client, response.job_id)
+        return response
 
-    def wait(self, client, job_id):
+    def wait(self, job):
         """
         Wait for the query to finish executing.
 
-        :param client:  The BigQuery client object.
-        :param job_id:  job_id to verify finishes.
+        :param job:  The QueryJob to verify finishes.
         """
         LOGGER.info(
-            f"sleeping for table:\t{self.get_tablename()}\t\tjob_id:\t{job_id}")
-        status = 'NONE'
-
-        while True:
-            status = client.get_job(job_id).state
-
-            if status == 'DONE':
-                break
-            else:
-                time.sleep(5)
+            f"sleeping for table:\t{self.get_tablename()}\t\tjob_id:\t{job.job_id}"
+        )
+        try:
+            job.result()
+        except Exception:
+            LOGGER.exception(f"bigquery job failed for table:\t"
+                             f"{self.get_tablename()}\t\tjob_id:\t{job.job_id}")
 
-        LOGGER.info(f"awake.  status is:\t{status}")
+        LOGGER.info(f"awake.  status is:\t{job.state}")
 
 
 def main(raw_args=None):
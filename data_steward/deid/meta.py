@@ -6,10 +6,51 @@ This is a factory that handles rules generated into a canonical form and sends
 them to a deid engine for processing
 """
 import sqlite3
+import threading
 
+import cachetools
 from google.cloud import bigquery as bq
+from google.cloud.exceptions import NotFound
 import pandas as pd
 
+import constants.bq_utils as bq_consts
+
+_TABLE_CACHE = cachetools.TTLCache(maxsize=bq_consts.TABLE_INFO_CACHE_MAXSIZE,
+                                   ttl=bq_consts.TABLE_INFO_CACHE_TTL)
+_TABLE_CACHE_LOCK = threading.RLock()
+
+
+@cachetools.cached(cache={})
+def _get_client(private_key):
+    """
+    Get a bigquery client for a service account key file
+
+    Clients are cached by key file so the key is only parsed once.
+
+    :param private_key:  path of the service account key file
+    :return:  a bigquery client
+    """
+    return bq.Client.from_service_account_json(private_key)
+
+
+@cachetools.cached(_TABLE_CACHE,
+                   key=lambda client, fq_table_id: fq_table_id,
+                   lock=_TABLE_CACHE_LOCK)
+def _get_table(client, fq_table_id):
+    """
+    Get a bigquery table, caching the result
+
+    Results are cached for `TABLE_INFO_CACHE_TTL` seconds.
+
+    :param client:  the bigquery client
+    :param fq_table_id:  fully qualified table id, i.e. project.dataset.table
+    :return:  the table or None if it does not exist
+    """
+    try:
+        return client.get_table(fq_table_id)
+    except NotFound:
+        return None
+
 
 class Meta(object):
 
@@ -43,6 +84,8 @@ class Meta(object):
         :param table:  name of the table
         :param project:  name of the bigquery project
         :param dataset:  name of the dataset
+        :param client:  optional bigquery client to use instead of one built
+            from the key file
 
         :return:  table meta data
         """
@@ -52,12 +95,9 @@ class Meta(object):
         dataset_id = args.get('dataset_id')
         schema = args.get('schema', dataset_id)
 
-        fq_dataset_id = project_id + '.' + dataset_id
-        client = bq.Client.from_service_account_json(private_key)
-        dataset_ref = client.get_dataset(fq_dataset_id)
-        tables = client.list_tables(dataset_ref)
-        tables = [table for table in tables if table.table_id == table_name]
-        return tables[0] if tables else None
+        fq_table_id = '.'.join([project_id, dataset_id, table_name])
+        client = args.get('client') or _get_client(private_key)
+        return _get_table(client, fq_table_id)
 
     def instance(self, **args):
         """
@@ -23,21 +23,16 @@ class Parse(object):
 
     @staticmethod
     def init(rule_id, row, cache, tablename):
-        try:
-            row_rules = row.get('rules', '')
-            _id, _key = row_rules.replace('@', '').split('.')
-        except ValueError:
-            _id, _key = None, None
+        # a reference to cached rules looks like '@<id>.<key>'
+        parts = row.get('rules', '').replace('@', '').split('.')
+        _id, _key = parts if len(parts) == 2 else (None, None)
 
         label = ".".join([_id, _key]) if _key is not None else rule_id
 
-        if _id and _key and _id in cache and _key in cache[_id]:
-            p = {'label': label, 'rules': cache[_id][_key]}
-
-        else:
-            p = {'label': label}
-        for key in row:
-            p[key] = row[key] if key not in p else p[key]
+        p = dict(row)
+        p['label'] = label
+        if _id and _key and _key in cache.get(_id, ()):
+            p['rules'] = cache[_id][_key]
 
         p['tablename'] = tablename
         return p
@@ -3,23 +3,31 @@ This class applies rules and meta data to yield a certain output
 """
 # Python imports
 import codecs
+import copy
 import json
 import logging
 import os
+import threading
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # Third party imports
+import cachetools
 import pandas as pd
 import numpy as np
 
 # Project imports
 import bq_utils
+from constants.deid.deid import SIMULATE_MAX_WORKERS
 from resources import fields_for
 from deid.rules import Deid, create_on_string
 
 LOGGER = logging.getLogger(__name__)
 
+_RULES_CACHE = cachetools.LRUCache(maxsize=16)
+_RULES_LOCK = threading.RLock()
+
 
 def set_up_logging(log_path, idataset):
     """
@@ -58,6 +66,22 @@ def set_up_logging(log_path, idataset):
                             format=file_format)
 
 
+@cachetools.cached(_RULES_CACHE, lock=_RULES_LOCK)
+def _load_rules(rules_path, mtime):
+    """
+    Load a rules file
+
+    The parsed rules are cached by path and modification time, so a rules file
+    shared by many tables is only parsed once.  The result must not be mutated.
+
+    :param rules_path: path of the json rules file
+    :param mtime: modification time of the rules file, part of the cache key
+    :return: the parsed rules
+    """
+    with codecs.open(rules_path, 'r') as config:
+        return json.loads(config.read())
+
+
 class Press(ABC):
 
     def __init__(self, **args):
@@ -75,8 +99,10 @@ class Press(ABC):
         self.logpath = args.get('logs', 'logs')
         set_up_logging(self.logpath, self.idataset)
 
-        with codecs.open(args.get('rules'), 'r') as config:
-            self.deid_rules = json.loads(config.read())
+        rules_path = args.get('rules')
+        # the rules are modified per table, work on a copy of the cached rules
+        self.deid_rules = copy.deepcopy(
+            _load_rules(rules_path, os.path.getmtime(rules_path)))
 
         self.pipeline = args.get('pipeline',
                                  ['generalize', 'suppress', 'shift', 'compute'])
@@ -97,6 +123,7 @@ class Press(ABC):
             self.deid_rules = cache
 
         self.store = args.get('store', 'sqlite')
+        self._table_columns = {}
 
         if 'suppress' not in self.deid_rules:
             self.deid_rules['suppress'] = {'FILTERS': []}
@@ -127,16 +154,21 @@ class Press(ABC):
     def get_table_columns(self, tablename):
         """
         Return a list of columns for the given table name.
+
+        The columns are looked up once per table, callers get their own copy
+        of the list.
         """
-        info = bq_utils.get_table_info(tablename, dataset_id=self.idataset)
-        schema = info.get('schema', {})
-        fields = schema.get('fields')
+        if tablename not in self._table_columns:
+            info = bq_utils.get_table_info(tablename, dataset_id=self.idataset)
+            schema = info.get('schema', {})
+            fields = schema.get('fields')
 
-        field_names = []
-        for field in fields:
-            field_names.append(field.get('name'))
+            field_names = []
+            for field in fields:
+                field_names.append(field.get('name'))
+            self._table_columns[tablename] = field_names
 
-        return field_names
+        return list(self._table_columns[tablename])
 
     @abstractmethod
     def get_dataframe(self, sql=None, limit=None):
@@ -168,7 +200,7 @@ class Press(ABC):
 
         p = d.apply(self.table_info, self.store, self.get_tablename())
 
-        is_meta = np.sum([1 * ('on' in _item) for _item in p]) != 0
+        is_meta = any('on' in _item for _item in p)
         LOGGER.info(
             f"table:\t{self.get_tablename()}\t\tis a meta table:\t{is_meta}")
         if not is_meta:
@@ -267,10 +299,11 @@ class Press(ABC):
         """
         table_name = self.idataset + "." + self.tablename
         suppression_filters = self.deid_rules['suppress']['FILTERS']
-        out = pd.DataFrame()
+        samples = []
         counts = {}
         dirty_date = False
         filters = []
+        sample_queries = []
 
         for item in info:
             labels = item['label'].split('.')
@@ -314,14 +347,20 @@ class Press(ABC):
                 else:
                     sql_list.extend(['WHERE ', item['on']])
 
-            if 'shift' in labels:
-                data_frame = self.get_dataframe(sql=" ".join(sql_list).replace(
-                    ':idataset', self.idataset),
-                                                limit=5)
-            else:
-                data_frame = self.get_dataframe(
-                    sql=" ".join(sql_list).replace(':idataset', self.idataset))
+            sql = " ".join(sql_list).replace(':idataset', self.idataset)
+            limit = 5 if 'shift' in labels else None
+            sample_queries.append((item, sql, limit))
+
+        # the sample queries are independent, run them concurrently
+        with ThreadPoolExecutor(max_workers=SIMULATE_MAX_WORKERS) as executor:
+            data_frames = list(
+                executor.map(
+                    lambda query: self.get_dataframe(sql=query[1],
+                                                     limit=query[2]),
+                    sample_queries))
 
+        for (item, _, _), data_frame in zip(sample_queries, data_frames):
+            field = item['name']
             if data_frame.shape[0] == 0:
                 LOGGER.info(
                     f"no data-found for simulation of table:\t{table_name}\t\t"
@@ -331,10 +370,11 @@ class Press(ABC):
             data_frame.columns = ['original', 'transformed']
             data_frame['attribute'] = field
             data_frame['task'] = item['label'].upper().replace('.', ' ')
-            out = out.append(data_frame)
+            samples.append(data_frame)
+        out = pd.concat(samples,
+                        ignore_index=True) if samples else pd.DataFrame()
         #-- Let's evaluate row suppression here
         #
-        out.index = range(out.shape[0])
         rdf = pd.DataFrame()
         if suppression_filters:
             filters += [
@@ -342,16 +382,11 @@ class Press(ABC):
                 for item in suppression_filters
                 if 'filter' in item
             ]
-            original_sql = ' (SELECT COUNT(*) as original FROM :table) AS ORIGINAL_TABLE ,'
-            original_sql = original_sql.replace(':table', table_name)
-            transformed_sql = '(SELECT COUNT(*) AS transformed FROM :table WHERE :filter) AS TRANSF_TABLE'
-            transformed_sql = transformed_sql.replace(':table', table_name)
-            transformed_sql = transformed_sql.replace(':filter',
-                                                      " OR ".join(filters))
-            sql_list = ['SELECT * FROM ', original_sql, transformed_sql]
-
-            r = self.get_dataframe(
-                sql=" ".join(sql_list).replace(":idataset", self.idataset))
+            # only the count of suppressed rows is reported
+            sql = (f'SELECT COUNT(*) AS transformed FROM {table_name} '
+                   f'WHERE {" OR ".join(filters)}')
+
+            r = self.get_dataframe(sql=sql.replace(":idataset", self.idataset))
             table_name = self.idataset + "." + self.tablename
 
             rdf = pd.DataFrame({
@@ -375,17 +410,18 @@ class Press(ABC):
             "operation": counts.keys(),
             "count": counts.values()
         })
-        stats = stats.append(rdf)
-        stats.index = range(stats.shape[0])
-        stats.reset_index()
+        stats = pd.concat([stats, rdf], ignore_index=True, sort=False)
 
         _map = {
-            os.path.join(root, 'samples-' + self.tablename + '.csv'): out,
-            os.path.join(root, 'stats-' + self.tablename + '.csv'): stats
+            os.path.join(root, 'samples-' + self.tablename + '.csv.gz'): out,
+            os.path.join(root, 'stats-' + self.tablename + '.csv.gz'): stats
         }
         for path in _map:
             _data_frame = _map[path]
-            _data_frame.to_csv(path)
+            _data_frame.to_csv(path,
+                               encoding='utf-8',
+                               index=False,
+                               compression='gzip')
 
         LOGGER.info(
             f"simulation completed for table:\t{table_name}\t\tvalue:\t{root}")
@@ -405,14 +441,16 @@ class Press(ABC):
         LOGGER.info(
             f"generating-sql for table:\t{table_name}\t\tfields:\t{fields}")
 
+        # positions of the fields not rewritten yet, the first matching rule wins
+        positions = {name: index for index, name in enumerate(fields)}
         for rule_id in self.pipeline:
             for row in info:
                 name = row['name']
 
-                if rule_id not in row['label'] or name not in fields:
+                if rule_id not in row['label'] or name not in positions:
                     continue
 
-                index = fields.index(name)
+                index = positions.pop(name)
                 fields[index] = row['apply']
                 LOGGER.info(
                     f"creating SQL for field:\t{name}\t\twith:\t{row['apply']}")
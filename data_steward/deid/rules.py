@@ -20,9 +20,10 @@
 """
 # Python imports
 import logging
+import re
 
 # Third party imports
-import numpy as np
+import cachetools
 
 # Project imports
 from deid.parser import Parse
@@ -30,6 +31,47 @@ from resources import fields_for
 
 LOGGER = logging.getLogger(__name__)
 
+# qualifiers of row suppression rules and the qualifiers that keep the other rows
+_NEGATED_QUALIFIERS = {
+    'IN': 'NOT IN',
+    '=': '<>',
+    'NOT IN': 'IN',
+    '<>': '=',
+    '': 'IS FALSE',
+    'TRUE': 'IS FALSE'
+}
+
+# number of distinct rule value lists whose SQL strings are kept
+_VALUES_STRING_CACHE_MAXSIZE = 1024
+
+
+@cachetools.cached(cache={})
+def _placeholder_pattern(names):
+    """
+    Compile a pattern matching the given :NAME placeholders
+
+    Longer names are tried first, so a name is never cut short by another
+    name it starts with.  Like str.replace, a placeholder also matches at the
+    start of a longer word, e.g. :table in :table_id.
+
+    :param names:  tuple of placeholder names, without the leading colon
+    :return:  the compiled pattern, the matched name is group 1
+    """
+    alternatives = sorted(names, key=len, reverse=True)
+    return re.compile(':(' + '|'.join(map(re.escape, alternatives)) + ')')
+
+
+def _fill_template(template, substitutions):
+    """
+    Substitute :NAME placeholders of a template in a single pass
+
+    :param template:  the template string
+    :param substitutions:  a dictionary of placeholder name to replacement
+    :return:  the template with all the placeholders substituted
+    """
+    pattern = _placeholder_pattern(tuple(sorted(substitutions)))
+    return pattern.sub(lambda match: substitutions[match.group(1)], template)
+
 
 def create_on_string(item):
     """
@@ -78,87 +120,138 @@ def _get_boolean(value):
     return False
 
 
-def _get_case_condition_syntax(cond, regex, gen_value, rule, rules, syntax):
+def _get_when_clause(regex, gen_value, syntax):
     """
-    Build case statement syntax.
+    Build one condition of a case statement.
 
-    :param cond:  The current conditional list
     :param regex:  The built up regular expression string
     :param gen_value:  The value to generalize values meeting the syntax into
-    :param rule:  The current dictionary rule that is being processed
-    :param rules:  The list of rules for processing a generalization
+    :param syntax:  The conditional syntax of the data store
 
-    :return:  A populated condition list, that when joined will form
-        part of a proper CASE statement
+    :return:  A condition, that when joined with the other conditions between
+        the opening and ELSE of a CASE statement forms a proper CASE statement
     """
-    if rules[0] == rule:
-        cond.append(syntax['IF'])
+    return " ".join([syntax['OPEN'], regex, syntax['THEN'], gen_value])
 
-    cond += [" ".join([syntax['OPEN'], regex, syntax['THEN'], gen_value])]
 
-    if rule == rules[-1]:
-        cond += [syntax['ELSE']]
+@cachetools.cached(
+    cache=cachetools.LRUCache(maxsize=_VALUES_STRING_CACHE_MAXSIZE),
+    key=lambda values: tuple((type(value), value) for value in values))
+def _get_values_string(values):
+    """
+    Join values into the contents of an SQL IN list.
 
-    return cond
+    The rules' value lists are the same for every table, so the strings are
+    cached by value.  The key includes the type of each value, since equal
+    values such as 1, 1.0 and True are written differently.
 
+    :param values:  a list of values.  if all the values are strings they are
+        quoted, otherwise they are used as is, e.g. integers
 
-class Rules(object):
+    :return:  a comma separated string of the values
+    """
+    try:
+        # using string values
+        return "'" + "','".join(values) + "'"
+    except TypeError:
+        # using non-string values, could be integers, floats, etc
+        return ','.join(str(value) for value in values)
 
-    def __init__(self, **args):
-        self.cache = {}
-        self.store_syntax = {
-            "sqlite": {
-                "apply": {
-                    "REGEXP":
-                        "LOWER(:FIELD) REGEXP LOWER(':VAR')",
-                    "COUNT":
-                        "SELECT COUNT(:FIELD) FROM :TABLE WHERE :KEY=:VALUE"
-                },
-                "cond_syntax": {
-                    "IF": "CASE WHEN",
-                    "OPEN": "",
-                    "THEN": "THEN",
-                    "ELSE": "ELSE",
-                    "CLOSE": "END"
-                },
-                "random": "random() % 365 "
+
+def _get_label_name(label):
+    """
+    Get the part of a rule label used in log messages.
+
+    :param label:  a rule label, e.g. 'generalize.RACE'
+
+    :return:  the text after the first '.', or the whole label if it has no '.'
+    """
+    label = label or ''
+    return label.split('.', 1)[1] if '.' in label else label
+
+
+def _get_suppressed_value(name, field_type, field_mode):
+    """
+    Build the projection of a suppressed column.
+
+    The suppressed value keeps the column's type, to prevent accidental type
+    changes.
+
+    :param name:  the column name
+    :param field_type:  the lower case type of the column
+    :param field_mode:  the lower case mode of the column
+
+    :return:  the projection, or None if the type can not be suppressed
+    """
+    if field_type == 'string':
+        if field_mode == 'nullable':
+            return "FORMAT('%i', NULL) AS " + name
+        return "'' AS " + name
+    elif field_type == 'integer':
+        if field_mode == 'nullable':
+            return 'NULL AS ' + name
+        return "0 AS " + name
+
+    return None
+
+
+class Rules(object):
+    # query syntax of the supported stores, shared by all instances
+    STORE_SYNTAX = {
+        "sqlite": {
+            "apply": {
+                "REGEXP": "LOWER(:FIELD) REGEXP LOWER(':VAR')",
+                "COUNT": "SELECT COUNT(:FIELD) FROM :TABLE WHERE :KEY=:VALUE"
+            },
+            "cond_syntax": {
+                "IF": "CASE WHEN",
+                "OPEN": "",
+                "THEN": "THEN",
+                "ELSE": "ELSE",
+                "CLOSE": "END"
             },
-            "bigquery": {
-                "apply": {
-                    "REGEXP":
-                        "REGEXP_CONTAINS (LOWER(:FIELD), LOWER(':VAR'))",
-                    "COUNT":
-                        "SELECT COUNT (:KEY) FROM :DATASET.:TABLE AS :ALIAS WHERE :KEY=:VALUE",
-                    "COUNT-DISTINCT":
-                        ("SELECT COUNT (DISTINCT :ALIAS.:DISTINCT_FIELD) "
-                         "FROM :DATASET.:TABLE AS :ALIAS WHERE :KEY=:VALUE"),
-                    "SQL":
-                        ":SQL_STATEMENT"
-                },
-                "cond_syntax": {
-                    "IF": "CASE",
-                    "OPEN": "WHEN",
-                    "THEN": "THEN",
-                    "ELSE": "ELSE",
-                    "CLOSE": "END"
-                },
-                "random": "CAST( (RAND() * 364) + 1 AS INT64)"
+            "random": "random() % 365 "
+        },
+        "bigquery": {
+            "apply": {
+                "REGEXP":
+                    "REGEXP_CONTAINS (LOWER(:FIELD), LOWER(':VAR'))",
+                "COUNT":
+                    "SELECT COUNT (:KEY) FROM :DATASET.:TABLE AS :ALIAS WHERE :KEY=:VALUE",
+                "COUNT-DISTINCT":
+                    ("SELECT COUNT (DISTINCT :ALIAS.:DISTINCT_FIELD) "
+                     "FROM :DATASET.:TABLE AS :ALIAS WHERE :KEY=:VALUE"),
+                "SQL":
+                    ":SQL_STATEMENT"
             },
-            "postgresql": {
-                "cond_syntax": {
-                    "IF": "CASE WHEN",
-                    "OPEN": "",
-                    "THEN": "THEN",
-                    "ELSE": "ELSE",
-                    "CLOSE": "END"
-                },
-                "shift": {
-                    "date": "FIELD INTERVAL 'SHIFT DAY' ",
-                    "datetime": "FIELD INTERVAL 'SHIFT DAY'"
-                },
-                "random": "(random() * 364) + 1 :: int"
-            }
+            "cond_syntax": {
+                "IF": "CASE",
+                "OPEN": "WHEN",
+                "THEN": "THEN",
+                "ELSE": "ELSE",
+                "CLOSE": "END"
+            },
+            "random": "CAST( (RAND() * 364) + 1 AS INT64)"
+        },
+        "postgresql": {
+            "cond_syntax": {
+                "IF": "CASE WHEN",
+                "OPEN": "",
+                "THEN": "THEN",
+                "ELSE": "ELSE",
+                "CLOSE": "END"
+            },
+            "shift": {
+                "date": "FIELD INTERVAL 'SHIFT DAY' ",
+                "datetime": "FIELD INTERVAL 'SHIFT DAY'"
+            },
+            "random": "(random() * 364) + 1 :: int"
         }
+    }
+
+    def __init__(self, **args):
+        self.cache = {}
+        self.store_syntax = Rules.STORE_SYNTAX
         self.pipeline = args.get('pipeline',
                                  ['generalize', 'compute', 'suppress', 'shift'])
         self.cache = args.get('rules', [])
@@ -183,36 +276,30 @@ class Rules(object):
     def validate(self, rule_id, entry, tablename):
         """
         Validating if a the application of a rule relative to a table is valid
-        """
-        p = rule_id in self.cache
 
-        q = []
+        Only references to a rule applied relative to an attribute can be
+        invalid, any other row (lists of strings, self contained rules and
+        filters) is accepted as is.
+        """
+        rule_keys = self.cache.get(rule_id, {})
 
         for row in entry:
+            if 'rules' not in row:
+                continue
+
+            rules = row['rules']
+            is_applied = not isinstance(
+                rules, list) and rules.startswith('@') and "into" in row
+            if not is_applied:
+                continue
+            #
+            # Making sure the expression is {apply,into} suggesting a rule applied relative to an attribute
+            # finding the rules that need to be applied to a given attribute
+            _id, _key = rules.replace('@', '').split('.')
+            if _id != rule_id or _key not in rule_keys:
+                return False
 
-            if 'rules' in row:
-                if not isinstance(row['rules'],
-                                  list) and row['rules'].startswith(
-                                      '@') and "into" in row:
-                    #
-                    # Making sure the expression is {apply,into} suggesting a rule applied relative to an attribute
-                    # finding the rules that need to be applied to a given attribute
-                    _id, _key = row['rules'].replace('@', '').split('.')
-                    q.append((_id == rule_id) and (_key in self.cache[rule_id]))
-                else:
-                    q.append(1)
-            elif 'rules' not in row and isinstance(row, list) or not p:
-                #
-                # assuming we are dealing with a list of strings applied
-                # and dealign with self contained rules
-                q.append(1)
-            else:
-                if 'on' in row and 'values' in row and 'qualifier' in row:
-                    q.append(1)
-
-        q = sum(q) == len(q)
-
-        return (p and q) or (not p and q)
+        return True
 
 
 class Deid(Rules):
@@ -319,80 +406,86 @@ class Deid(Rules):
         """
         fields = args.get('fields', [args.get('value_field', '')])
         label = args.get('label', '')
+        label_name = _get_label_name(label)
         rules = args.get('rules', [])
+        on = args.get('on')
+        has_into = 'into' in args
+        into = args.get('into')
+        table = args.get('table', 'table_NOT_SET')
+        alias = args.get('alias', 'alias NOT SET')
+        # the placeholders of aggregate templates are the same for every rule
+        aggregate_substitutions = {
+            'TABLE': args.get('table', 'table NOT SET'),
+            'KEY': args.get('key_field', 'key_field NOT SET'),
+            'VALUE': args.get('value_field', 'value_field NOT SET'),
+            'DATASET': args.get('dataset', 'dataset NOT SET'),
+            'ALIAS': alias
+        }
 
         store_id = args.get('store', 'sqlite')
-        syntax = self.store_syntax[store_id]['cond_syntax']
+        store_syntax = self.store_syntax[store_id]
+        syntax = store_syntax['cond_syntax']
+        # not every store defines templates for functions
+        apply_fn = store_syntax.get('apply')
+
+        # the generalized value of a rule is the same for every field
+        gen_values = []
+        for rule in rules:
+            gen_value = into if has_into else rule.get('into', '')
+            if isinstance(gen_value, int):
+                gen_values.append((True, str(gen_value)))
+            else:
+                gen_values.append((False, "'" + gen_value + "'"))
+
         out = []
         for name in fields:
-            cond = []
-            for rule in rules:
+            fillter = args.get('filter', name)
+            key_row = args.get('key_row', name).replace(':name', name)
+            whens = []
+            for rule, (is_numeric, gen_value) in zip(rules, gen_values):
                 qualifier = rule.get('qualifier', '')
 
                 if 'apply' in rule:
                     #
                     # This will call a built-in SQL function (non-aggregate)'
-                    fillter = args.get('filter', name)
-                    LOGGER.info(
-                        f"generalizing with SQL aggregates label:\t{label.split('.')[1]}\t\t"
-                        f"on:\t{name}\t\ttype:\t{rule['apply']}\t\t")
+                    LOGGER.debug(
+                        "generalizing with SQL aggregates label:\t%s\t\t"
+                        "on:\t%s\t\ttype:\t%s\t\t", label_name, name,
+                        rule['apply'])
 
-                    if 'apply' not in self.store_syntax[store_id]:
-                        regex = [
+                    if apply_fn is None:
+                        regex = "".join([
                             rule['apply'], "(", fillter, " , '",
                             "|".join(rule['values']), "') ", qualifier
-                        ]
+                        ])
                     else:
-                        template = self.store_syntax[store_id]['apply'][
-                            rule['apply']]
-                        regex = template.replace(':FIELD', fillter).replace(
-                            ':FN', rule['apply'])
+                        template = apply_fn[rule['apply']]
+                        is_aggregate = rule['apply'] in [
+                            'COUNT', 'COUNT-DISTINCT', 'AVG', 'SUM'
+                        ]
+                        substitutions = {'FIELD': fillter, 'FN': rule['apply']}
 
                         if ':VAR' in template:
-                            regex = regex.replace(":VAR",
-                                                  "|".join(rule['values']))
+                            substitutions['VAR'] = "|".join(rule['values'])
 
-                        if rule['apply'] in [
-                                'COUNT', 'COUNT-DISTINCT', 'AVG', 'SUM'
-                        ]:
+                        if is_aggregate:
                             #
                             # Dealing with an aggregate expression. It is important to know what we are counting
                             # count(:field) from :table [where filter]
                             #
-                            regex = regex.replace(
-                                ':TABLE', args.get('table', 'table NOT SET'))
-                            regex = regex.replace(
-                                ':KEY',
-                                args.get('key_field', 'key_field NOT SET'))
-                            regex = regex.replace(
-                                ':VALUE',
-                                args.get('value_field', 'value_field NOT SET'))
-                            regex = regex.replace(
-                                ':DATASET',
-                                args.get('dataset', 'dataset NOT SET'))
-                            regex = regex.replace(
-                                ':ALIAS', args.get('alias', 'alias NOT SET'))
-                            regex = regex.replace(
-                                ':DISTINCT_FIELD',
-                                rule.get('distinct', 'distinct NOT SET'))
+                            substitutions.update(aggregate_substitutions)
+                            substitutions['DISTINCT_FIELD'] = rule.get(
+                                'distinct', 'distinct NOT SET')
 
+                        regex = _fill_template(template, substitutions)
+
+                        if is_aggregate:
                             if 'on' in rule:
-                                key_row = args[
-                                    'key_row'] if 'key_row' in args else name
-                                key_row = key_row.replace(':name', name)
                                 conjunction = ' AND ' if 'qualifier' in rule else ' WHERE '
 
                                 if isinstance(rule.get('on'), list):
-                                    try:
-                                        val_list = " IN ('" + "','".join(
-                                            rule['on']) + "')"
-                                    except TypeError:
-                                        val_list = [
-                                            str(val_item)
-                                            for val_item in rule['on']
-                                        ]
-                                        val_list = " IN (" + ",".join(
-                                            val_list) + ")"
+                                    val_list = " IN (" + _get_values_string(
+                                        rule['on']) + ")"
                                     regex += conjunction + key_row + val_list
                                 # the following conditions added to help with nullable columns
                                 elif 'exists' in rule.get('on', ''):
@@ -402,11 +495,8 @@ class Deid(Rules):
                                     val_list = "(" + rule.get('on', '') + ")"
                                     regex += conjunction + val_list
 
-                            if 'on' in args:
-                                conditional, _ = create_on_string(
-                                    args.get('on'))
-
-                                alias = args.get('alias', 'alias NOT SET')
+                            if on is not None:
+                                conditional, _ = create_on_string(on)
                                 conditional = conditional.replace(
                                     ':join_tablename', alias)
                                 regex += ' AND ' + conditional
@@ -416,8 +506,7 @@ class Deid(Rules):
                             statement = rule.get('statement',
                                                  ['statement NOT SET'])
                             statement = ' '.join(statement)
-                            statement = statement.replace(
-                                ':table', args.get('table', 'table_NOT_SET'))
+                            statement = statement.replace(':table', table)
                             statement = statement.replace(':fields', fillter)
                             regex = regex.replace(':SQL_STATEMENT', statement)
 
@@ -428,17 +517,8 @@ class Deid(Rules):
                         #
                         # Is there a filter associated with the aggregate function or not
                         #
-                    if 'into' in rule or 'into' in args:
-                        gen_value = args.get('into', rule.get('into', ''))
-
-                        if not isinstance(gen_value, int):
-                            gen_value = "'" + gen_value + "'"
-                        else:
-                            gen_value = str(gen_value)
-
-                        regex = "".join(regex)
-                        cond = _get_case_condition_syntax(
-                            cond, regex, gen_value, rule, rules, syntax)
+                    if 'into' in rule or has_into:
+                        whens.append(_get_when_clause(regex, gen_value, syntax))
 
                 else:
                     #
@@ -446,37 +526,34 @@ class Deid(Rules):
                     # @TODO: Document what is going on here
                     #   - An if or else type of generalization given a list of values or function
                     #   - IF <filter> IN <values>, THEN <generalized-value> else <attribute>
-                    LOGGER.info(
-                        f"generalizing inline arguments label:\t{{label.split('.')[1]}}\t\t"
-                        f"on:\t{name}\t\ttype:\tinline")
-                    fillter = args.get('filter', name)
-                    qualifier = rule.get('qualifier', '')
-                    gen_value = args.get('into', rule.get('into', ''))
-
-                    if isinstance(gen_value, int):
-                        gen_value = str(gen_value)
+                    LOGGER.debug(
+                        "generalizing inline arguments label:\t%s\t\t"
+                        "on:\t%s\t\ttype:\tinline", label_name, name)
+                    if is_numeric:
                         values = [str(value) for value in rule['values']]
                         values = '(' + ','.join(values) + ')'
                     else:
-                        gen_value = "'" + gen_value + "'"
-                        values = "('" + "','".join(rule['values']) + "')"
+                        values = "(" + _get_values_string(rule['values']) + ")"
 
                     regex_list = [fillter, qualifier, values]
 
                     regex = " ".join(regex_list)
-                    cond = _get_case_condition_syntax(cond, regex, gen_value,
-                                                      rule, rules, syntax)
+                    whens.append(_get_when_clause(regex, gen_value, syntax))
 
             #
             # Let's build the syntax here to make it sound for any persistence storage
-            cond += [name]
-            cond_counts = sum([1 for xchar in cond if syntax['IF'] in xchar])
-            cond += np.repeat(syntax['CLOSE'], cond_counts).tolist()
+            # a single CASE holds the conditions of all the rules
+            if whens:
+                cond = [
+                    syntax['IF'], *whens, syntax['ELSE'], name, syntax['CLOSE']
+                ]
+            else:
+                cond = [name]
 
             cond += ['AS', name]
             result = {"name": name, "apply": " ".join(cond), "label": label}
-            if 'on' in args:
-                result['on'] = args['on']
+            if on is not None:
+                result['on'] = on
 
             out.append(result)
 
@@ -498,8 +575,8 @@ class Deid(Rules):
                         "apply": " ".join(cond),
                         "label": label
                     }
-                    if 'on' in args:
-                        copy_result['on'] = args['on']
+                    if on is not None:
+                        copy_result['on'] = on
                     out.append(copy_result)
         #
         # This will return the fields that need generalization as specified.
@@ -513,10 +590,12 @@ class Deid(Rules):
 
         rules = args.get('rules', {})
         label = args.get('label')
+        label_name = _get_label_name(label)
         fields = args.get('fields', [])
         store_id = args.get('store')
-        apply_fn = self.store_syntax[store_id][
-            'apply'] if 'apply' in self.store_syntax[store_id] else {}
+        apply_fn = self.store_syntax[store_id].get('apply', {})
+        suppress_rules = self.cache.setdefault('suppress', {})
+        filters = suppress_rules.setdefault('FILTERS', [])
         out = []
 
         tablename = args.get('tablename').split('.')[1]
@@ -538,21 +617,10 @@ class Deid(Rules):
                     # This scenario, we know the fields upfront and don't have a rule for them
                     # We just need them removed (simple/basic case)
                     #
-                    #-- This will prevent accidental type changes
-                    if field_type == 'string':
-                        if field_mode == 'nullable':
-                            value = "FORMAT('%i', NULL) AS " + name
-                        else:
-                            value = "'' AS " + name
-                    elif field_type == 'integer':
-                        if field_mode == 'nullable':
-                            value = 'NULL AS ' + name
-                        else:
-                            value = "0 AS " + name
-
+                    value = _get_suppressed_value(name, field_type, field_mode)
                     out.append({"name": name, "apply": value, "label": label})
-                    LOGGER.info(
-                        f"suppress fields(columns) for:\t{label.split('.')[1]}")
+                    LOGGER.debug("suppress fields(columns) for:\t%s",
+                                 label_name)
                 else:
                     #
                     # If we have alist of fields to be removed, The following code will figure out which ones apply
@@ -562,58 +630,32 @@ class Deid(Rules):
                     for rule in rules:
                         if 'apply' not in rules:
                             if name in rule['values']:
-                                #-- This will prevent accidental type changes
-                                if field_type == 'string':
-                                    if field_mode == 'nullable':
-                                        value = "FORMAT('%i', NULL) AS " + name
-                                    else:
-                                        value = "'' AS " + name
-                                elif field_type == 'integer':
-                                    if field_mode == 'nullable':
-                                        value = 'NULL AS ' + name
-                                    else:
-                                        value = "0 AS " + name
+                                value = _get_suppressed_value(
+                                    name, field_type, field_mode)
                                 out.append({
                                     "name": name,
                                     "apply": (value),
                                     "label": label
                                 })
             LOGGER.info(
-                f"suppress fields(columns):\t{label.split('.')[1]}\t\tfor:\t{fields}"
-            )
+                f"suppress fields(columns):\t{label_name}\t\tfor:\t{fields}")
 
         else:
             #
             # In this case we are just removing the entire row we will be expecting :
             #   - filter    as the key field to match the filter
             #   - The values of the filter are provided by the rule
-            apply_qualifier = {
-                'IN': 'NOT IN',
-                '=': '<>',
-                'NOT IN': 'IN',
-                '<>': '=',
-                '': 'IS FALSE',
-                'TRUE': 'IS FALSE'
-            }
-
+            on = args.get('on')
+            qualifier = args.get('qualifier', '')
             if not rules:
                 #
                 # A row suppression rule has been provided in the form of an SQL filter
                 # The qualifier needs to be flipped ...
-                on = args['on']
-
                 if isinstance(on, dict):
-                    try:
-                        # using string values
-                        fillter_values = "'" + "','".join(
-                            on.get('values')) + "'"
-                    except TypeError:
-                        # using non-string values, could be integers, floats, etc
-                        int_strings = [str(value) for value in on.get('values')]
-                        fillter_values = ','.join(int_strings)
+                    fillter_values = _get_values_string(on.get('values'))
 
                     fillter = ' '.join([
-                        args.get('qualifier'), '(',
+                        qualifier, '(',
                         on.get('condition'), "(", fillter_values, "))"
                     ])
                     on = fillter
@@ -649,51 +691,40 @@ class Deid(Rules):
                     fillter = fillter.replace(' like ', ' NOT LIKE ')
 
                 fillter = {"filter": fillter, "label": "suppress.ROWS"}
-                found = [
-                    1 * (fillter == row)
-                    for row in self.cache['suppress']['FILTERS']
-                ]
 
-                if np.sum(found) == 0:
-                    self.cache['suppress']['FILTERS'] += [fillter]
-                    self.parent.deid_rules['suppress']['FILTERS'] = self.cache[
-                        'suppress']['FILTERS']
+                if fillter not in filters:
+                    filters.append(fillter)
+                    self.parent.deid_rules['suppress']['FILTERS'] = filters
                 return []
 
+            key_field = args.get('filter', on)
             for rule in rules:
-                qualifier = args['qualifier'] if 'qualifier' in args else ''
-
                 if 'apply' in rule and rule['apply'] in apply_fn:
-                    template = self.store_syntax[store_id]['apply'][
-                        rule['apply']]
-                    key_field = args['filter'] if 'filter' in args else args[
-                        'on']
-                    expression = template.replace(':VAR',
-                                                  "|".join(rule['values']))
-                    expression = expression.replace(':FN', rule['apply'])
-                    expression = expression.replace(':FIELD', key_field)
-                    self.cache['suppress']['FILTERS'].append({
+                    template = apply_fn[rule['apply']]
+                    expression = _fill_template(
+                        template, {
+                            'VAR': "|".join(rule['values']),
+                            'FN': rule['apply'],
+                            'FIELD': key_field
+                        })
+                    filters.append({
                         "filter": expression + ' ' + qualifier,
                         "label": label
                     })
-                elif 'on' in args:
+                elif on is not None:
                     # If we have no application of a function, we will
                     # assume an expression of type <attribute> IN <list>
                     # we have a basic SQL statement here
-                    qualifier = 'IN' if qualifier == '' else qualifier
-                    qualifier = apply_qualifier[qualifier]
+                    negated_qualifier = _NEGATED_QUALIFIERS[qualifier or 'IN']
                     if 'values' in rule:
                         expression = " ".join([
-                            args['on'], qualifier,
-                            "('" + "','".join(rule['values']) + "')"
+                            on, negated_qualifier,
+                            "(" + _get_values_string(rule['values']) + ")"
                         ])
                     else:
-                        expression = args['on']
+                        expression = on
 
-                    self.cache['suppress']['FILTERS'].append({
-                        "filter": expression,
-                        "label": label
-                    })
+                    filters.append({"filter": expression, "label": label})
         return out
 
     def shift(self, **args):
@@ -716,16 +747,17 @@ class Deid(Rules):
 
         if 'fields' in args:
             fields = args['fields']
+            rules = args['rules']
+            on = args.get('on')
 
             for name in fields:
-                rules = args['rules']
                 result = {
                     "apply": rules.replace(':FIELD', name),
                     "label": label,
                     "name": name
                 }
-                if 'on' in args:
-                    result['on'] = args['on']
+                if on is not None:
+                    result['on'] = on
                     xchar = ' AS ' if ' AS ' in result['apply'] else ' as '
                     suffix = xchar + result['apply'].split(xchar)[-1]
 
@@ -734,8 +766,6 @@ class Deid(Rules):
                         'AS STRING ) ', suffix
                     ])
                 out.append(result)
-        else:
-            pass
 
         return out
 
@@ -757,15 +787,15 @@ class Deid(Rules):
         out = []
 
         rule_str = ' '.join(args.get('rules', []))
-        statement = rule_str.replace(':FIELD',
-                                     fields[0]).replace(':value_field',
-                                                        value_field)
+        substitutions = {'FIELD': fields[0], 'value_field': value_field}
 
         if 'key_field' in args:
-            statement = statement.replace(':key_field', args['key_field'])
+            substitutions['key_field'] = args['key_field']
 
         if 'table' in args:
-            statement = statement.replace(':table', args['table'])
+            substitutions['table'] = args['table']
+
+        statement = _fill_template(rule_str, substitutions)
 
         out.append({"apply": statement, "name": fields[0], "label": label})
         return out
@@ -775,28 +805,21 @@ class Deid(Rules):
         :info    is a specification of a table and the rules associated
         """
         out = []
-        r = {}
-        ismeta = info['info'][
-            'type'] if 'info' in info and 'type' in info['info'] else False
 
         for rule_id in self.pipeline:
             if rule_id in info:
-                r = self.validate(rule_id, info[rule_id], tablename)
-
-                if r:
-                    r = dict(r, **{'ismeta': ismeta})
-                    pointer = r['pointer']
-                    tmp = [
-                        pointer(**dict(args, **{"store": store_id}))
-                        for args in r['args']
-                    ]
-                    if tmp:
-                        for _item in tmp:
-                            if _item:
-                                if isinstance(_item, dict):
-                                    out.append(_item)
-                                else:
-                                    out += _item
+                payload = self.validate(rule_id, info[rule_id], tablename)
+
+                if payload:
+                    pointer = payload['pointer']
+                    for args in payload['args']:
+                        _item = pointer(**dict(args, store=store_id))
+                        if not _item:
+                            continue
+                        if isinstance(_item, dict):
+                            out.append(_item)
+                        else:
+                            out.extend(_item)
             else:
                 LOGGER.info('rule_id:  {} not in info'.format(rule_id))
 
@@ -17,14 +17,11 @@ table = [{
 }]
 fields = [field['name'] for field in table]
 db = MongoClient()['deid']
-r = list(db.rules.find())
 cache = {}
 
-# updates default rules with existing rules
-for row in r:
-    row_id = row['_id']
-    del row['_id']
-    cache[row_id] = row
+# updates default rules with existing rules, streaming from the cursor
+for row in db.rules.find({}):
+    cache[row.pop('_id')] = row
 
 drules = Deid()
 drules.cache = cache
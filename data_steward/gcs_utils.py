@@ -87,27 +87,39 @@ def get_metadata(bucket, name, default=None):
     :param default: alternate value to return if object with the given name is not found
     :return: the object metadata if it exists, None otherwise
     """
-    all_objects = list_bucket(bucket)
-    for obj in all_objects:
+    # only objects whose names start with the name can match
+    for obj in iter_bucket(bucket, prefix=name):
         if obj['name'] == name:
             return obj
     return default
 
 
-def list_bucket(bucket):
+def iter_bucket(bucket, prefix=None):
     """
-    Get metadata for each object within a bucket
+    Iterate over the metadata of each object within a bucket
+
+    Pages of the listing are requested as the iteration reaches them.
+
     :param bucket: name of the bucket
-    :return: list of metadata objects
+    :param prefix: if specified, only list objects whose names begin with it
+    :return: generator of metadata objects
     """
     service = create_service()
-    req = service.objects().list(bucket=bucket)
-    all_objects = []
+    req = service.objects().list(bucket=bucket, prefix=prefix)
     while req:
         resp = req.execute(num_retries=GCS_DEFAULT_RETRY_COUNT)
-        all_objects.extend(resp.get('items', []))
+        yield from resp.get('items', [])
         req = service.objects().list_next(req, resp)
-    return all_objects
+
+
+def list_bucket(bucket, prefix=None):
+    """
+    Get metadata for each object within a bucket
+    :param bucket: name of the bucket
+    :param prefix: if specified, only list objects whose names begin with it
+    :return: list of metadata objects
+    """
+    return list(iter_bucket(bucket, prefix=prefix))
 
 
 def list_bucket_prefixes(gcs_path):
@@ -1,3 +1,4 @@
+import copy
 import csv
 import hashlib
 import inspect
@@ -123,16 +124,33 @@ def achilles_index_files():
     return achilles_index_files
 
 
-def fields_for(table, sub_path=None):
+@cachetools.cached(cache={})
+def _load_schema(json_path):
     """
-    Return the json schema for any table identified in the schemas directory.
+    Load a json schema file
+
+    The result is shared by all callers and must not be modified
+
+    :param json_path: absolute path to a json schema file
+    :return: the parsed schema
+    """
+    with open(json_path, 'r') as fp:
+        return json.load(fp)
 
-    Uses os.walk to traverse subdirectories
+
+@cachetools.cached(cache={})
+def _get_schema_path(table, sub_path=None):
+    """
+    Find the json schema file for a table in the schemas directory
+
+    Uses os.walk to traverse subdirectories.  The schema files do not change
+    while running, so the result is cached.
 
     :param table: The table to get a schema for
     :param sub_path: A string identifying a sub-directory in resource_files/schemas.
         If provided, this directory will be searched.
-    :returns: a json object representing the schemas for the named table
+    :returns: the path to the table's schema file
+    :raises RuntimeError: if no schema or more than one schema is found
     """
     path = os.path.join(fields_path, sub_path if sub_path else '')
 
@@ -157,10 +175,23 @@ def fields_for(table, sub_path=None):
         raise RuntimeError(
             f"Unable to find schema file for {table} in path {path}")
 
-    with open(json_path, 'r') as fp:
-        fields = json.load(fp)
+    return json_path
 
-    return fields
+
+def fields_for(table, sub_path=None):
+    """
+    Return the json schema for any table identified in the schemas directory.
+
+    Uses os.walk to traverse subdirectories
+
+    :param table: The table to get a schema for
+    :param sub_path: A string identifying a sub-directory in resource_files/schemas.
+        If provided, this directory will be searched.
+    :returns: a json object representing the schemas for the named table
+    """
+    json_path = _get_schema_path(table, sub_path)
+    # callers may modify the fields, so hand out a copy of the cached schema
+    return copy.deepcopy(_load_schema(json_path))
 
 
 def is_internal_table(table_id):
@@ -339,15 +370,72 @@ def hash_dir(in_dir):
     return hash_obj.hexdigest()
 
 
-CDM_TABLES = list(cdm_schemas().keys())
-MAPPING_TABLES = list(mapping_schemas().keys())
-ACHILLES_INDEX_FILES = achilles_index_files()
-CDM_FILES = [table + '.csv' for table in CDM_TABLES]
-ALL_ACHILLES_INDEX_FILES = [
-    name.split(resource_files_path + os.sep)[1].strip()
-    for name in ACHILLES_INDEX_FILES
-]
-IGNORE_LIST = [PROCESSED_TXT, RESULTS_HTML] + ALL_ACHILLES_INDEX_FILES
+@cachetools.cached(cache={})
+def _cdm_tables():
+    """
+    Get the names of the CDM tables, excluding achilles and vocabulary tables
+    """
+    return list(cdm_schemas().keys())
+
+
+@cachetools.cached(cache={})
+def _cdm_files():
+    """
+    Get the names of the files submitted for the CDM tables
+    """
+    return [table + '.csv' for table in _cdm_tables()]
+
+
+@cachetools.cached(cache={})
+def _mapping_tables():
+    """
+    Get the names of the mapping tables
+    """
+    return list(mapping_schemas().keys())
+
+
+@cachetools.cached(cache={})
+def _achilles_index_files():
+    """
+    Get the absolute paths of the achilles index files
+    """
+    return achilles_index_files()
+
+
+@cachetools.cached(cache={})
+def _all_achilles_index_files():
+    """
+    Get the paths of the achilles index files relative to resource_files
+    """
+    return [
+        name.split(resource_files_path + os.sep)[1].strip()
+        for name in _achilles_index_files()
+    ]
+
+
+@cachetools.cached(cache={})
+def _ignore_list():
+    """
+    Get the names of files in a submission bucket that are not validated
+    """
+    return [PROCESSED_TXT, RESULTS_HTML] + _all_achilles_index_files()
+
+
+# module constants which require reading resource files, computed on first use
+_LAZY_CONSTANTS = {
+    'CDM_TABLES': _cdm_tables,
+    'MAPPING_TABLES': _mapping_tables,
+    'ACHILLES_INDEX_FILES': _achilles_index_files,
+    'CDM_FILES': _cdm_files,
+    'ALL_ACHILLES_INDEX_FILES': _all_achilles_index_files,
+    'IGNORE_LIST': _ignore_list,
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_CONSTANTS:
+        return _LAZY_CONSTANTS[name]()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def get_domain_id_field(domain_table):
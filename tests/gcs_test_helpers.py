@@ -0,0 +1,81 @@
+"""
+Shared helpers for tests of code that reads and writes GCS objects
+"""
+import datetime
+from collections import defaultdict
+
+import mock
+
+GCS_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+class FakeGcs(object):
+    """
+    In-memory stand-in for the object functions of `gcs_utils`
+
+    Lets tests of logic that only lists, reads and writes bucket objects run
+    without GCS.
+
+    Example:
+        >>> import gcs_utils
+        >>> from tests.gcs_test_helpers import FakeGcs
+        >>> fake_gcs = FakeGcs()
+        >>> with fake_gcs.patch():
+        ...     gcs_utils.upload_object('fake_bucket', 'a/person.csv', fp)
+        ...     gcs_utils.list_bucket('fake_bucket')
+    """
+
+    def __init__(self):
+        # bucket name => object name => (metadata, contents)
+        self.buckets = defaultdict(dict)
+
+    def upload_object(self, bucket, name, fp):
+        contents = fp.read()
+        timestamp = datetime.datetime.utcnow().strftime(GCS_DATETIME_FORMAT)
+        metadata = {
+            'bucket': bucket,
+            'name': name,
+            'size': str(len(contents)),
+            'timeCreated': timestamp,
+            'updated': timestamp
+        }
+        self.buckets[bucket][name] = (metadata, contents)
+        return dict(metadata)
+
+    def iter_bucket(self, bucket, prefix=None):
+        for name, (metadata, _) in sorted(self.buckets[bucket].items()):
+            if prefix is None or name.startswith(prefix):
+                yield dict(metadata)
+
+    def list_bucket(self, bucket, prefix=None):
+        return list(self.iter_bucket(bucket, prefix=prefix))
+
+    def get_metadata(self, bucket, name, default=None):
+        if name in self.buckets[bucket]:
+            metadata, _ = self.buckets[bucket][name]
+            return dict(metadata)
+        return default
+
+    def get_object(self, bucket, name, as_text=True):
+        _, contents = self.buckets[bucket][name]
+        if as_text and isinstance(contents, bytes):
+            return contents.decode('utf-8')
+        return contents
+
+    def delete_object(self, bucket, name):
+        del self.buckets[bucket][name]
+        return ''
+
+    def patch(self):
+        """
+        Patch the `gcs_utils` object functions to use this fake
+
+        :return: a patcher usable as a context manager or decorator
+        """
+        return mock.patch.multiple('gcs_utils',
+                                   upload_object=self.upload_object,
+                                   iter_bucket=self.iter_bucket,
+                                   list_bucket=self.list_bucket,
+                                   get_metadata=self.get_metadata,
+                                   get_object=self.get_object,
+                                   delete_object=self.delete_object)
@@ -32,9 +32,7 @@ class ExportTest(unittest.TestCase):
         self.hpo_bucket = gcs_utils.get_hpo_bucket(FAKE_HPO_ID)
 
     def _empty_bucket(self):
-        bucket_items = gcs_utils.list_bucket(self.hpo_bucket)
-        for bucket_item in bucket_items:
-            gcs_utils.delete_object(self.hpo_bucket, bucket_item['name'])
+        test_util.empty_bucket(self.hpo_bucket)
 
     def _test_report_export(self, report):
         data_density_path = os.path.join(export.EXPORT_PATH, report)
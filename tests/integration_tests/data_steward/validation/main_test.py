@@ -2,18 +2,18 @@
 Unit test components of data_steward.validation.main
 """
 from __future__ import print_function
+from concurrent.futures import ThreadPoolExecutor
 import json
 import os
 import unittest
 from io import open
 
 import mock
-from bs4 import BeautifulSoup as bs
+from bs4 import BeautifulSoup as bs, SoupStrainer
 
 import bq_utils
 import app_identity
 import common
-from constants import bq_utils as bq_consts
 from constants.validation import main as main_consts
 import gcs_utils
 import resources
@@ -21,75 +21,69 @@ from tests import test_util
 from validation import main
 from validation.metrics import required_labs
 
+DRUG_CLASS = 'drug_class'
+
 
 class ValidationMainTest(unittest.TestCase):
+    # tables created once in setUpClass and kept between tests
+    SHARED_TABLES = [DRUG_CLASS]
 
     @classmethod
     def setUpClass(cls):
         print('**************************************************************')
         print(cls.__name__)
         print('**************************************************************')
+        # the configuration does not change between tests, read it once
+        cls.hpo_id = test_util.FAKE_HPO_ID
+        cls.hpo_bucket = gcs_utils.get_hpo_bucket(cls.hpo_id)
+        cls.nyc_bucket = gcs_utils.get_hpo_bucket('nyc')
+        cls.drc_bucket = gcs_utils.get_drc_bucket()
+        cls.project_id = app_identity.get_application_id()
+        cls.rdr_dataset_id = bq_utils.get_rdr_dataset_id()
+        cls.bigquery_dataset_id = bq_utils.get_dataset_id()
+        main.app.testing = True
+        cls.client = main.app.test_client()
+        # clear anything left by an earlier run once, tearDown resets the
+        # buckets and tables after each test
+        cls._clean_up_test_data()
+        # the drug_class lookup is the same for every test, build it once
+        cls._create_drug_class_table(cls.bigquery_dataset_id)
 
     def setUp(self):
-        self.hpo_id = test_util.FAKE_HPO_ID
-        self.hpo_bucket = gcs_utils.get_hpo_bucket(self.hpo_id)
-        self.project_id = app_identity.get_application_id()
-        self.rdr_dataset_id = bq_utils.get_rdr_dataset_id()
         mock_get_hpo_name = mock.patch('validation.main.get_hpo_name')
 
         self.mock_get_hpo_name = mock_get_hpo_name.start()
         self.mock_get_hpo_name.return_value = 'Fake HPO'
         self.addCleanup(mock_get_hpo_name.stop)
 
-        self.bigquery_dataset_id = bq_utils.get_dataset_id()
         self.folder_prefix = '2019-01-01-v1/'
-        self._empty_bucket()
-        test_util.delete_all_tables(self.bigquery_dataset_id)
-        self._create_drug_class_table(self.bigquery_dataset_id)
-
-    def _empty_bucket(self):
-        bucket_items = gcs_utils.list_bucket(self.hpo_bucket)
-        for bucket_item in bucket_items:
-            gcs_utils.delete_object(self.hpo_bucket, bucket_item['name'])
 
     @staticmethod
     def _create_drug_class_table(bigquery_dataset_id):
-
-        table_name = 'drug_class'
-        fields = [{
-            "type": "integer",
-            "name": "concept_id",
-            "mode": "required"
-        }, {
-            "type": "string",
-            "name": "concept_name",
-            "mode": "required"
-        }, {
-            "type": "string",
-            "name": "drug_class_name",
-            "mode": "required"
-        }]
-        bq_utils.create_table(table_id=table_name,
-                              fields=fields,
-                              drop_existing=True,
-                              dataset_id=bigquery_dataset_id)
-
-        bq_utils.query(q=main_consts.DRUG_CLASS_QUERY.format(
-            dataset_id=bigquery_dataset_id),
-                       use_legacy_sql=False,
-                       destination_table_id='drug_class',
-                       retry_count=bq_consts.BQ_DEFAULT_RETRY_COUNT,
-                       write_disposition='WRITE_TRUNCATE',
-                       destination_dataset_id=bigquery_dataset_id)
+        # create the table and populate it in a single job
+        drug_class_query = """CREATE OR REPLACE TABLE {dataset}.{table} (
+            concept_id INT64 NOT NULL,
+            concept_name STRING NOT NULL,
+            drug_class_name STRING NOT NULL
+        ) AS {query}""".format(dataset=bigquery_dataset_id,
+                               table=DRUG_CLASS,
+                               query=main_consts.DRUG_CLASS_QUERY.format(
+                                   dataset_id=bigquery_dataset_id))
 
         # ensure concept ancestor table exists
-        if not bq_utils.table_exists(common.CONCEPT_ANCESTOR):
-            bq_utils.create_standard_table(common.CONCEPT_ANCESTOR,
-                                           common.CONCEPT_ANCESTOR)
-            q = """INSERT INTO {dataset}.concept_ancestor
-            SELECT * FROM {vocab}.concept_ancestor""".format(
-                dataset=bigquery_dataset_id, vocab=common.VOCABULARY_DATASET)
-            bq_utils.query(q)
+        concept_ancestor_query = """
+        CREATE TABLE IF NOT EXISTS {dataset}.{table} AS
+        SELECT * FROM {vocab}.{table}""".format(dataset=bigquery_dataset_id,
+                                                table=common.CONCEPT_ANCESTOR,
+                                                vocab=common.VOCABULARY_DATASET)
+
+        # the tables are independent, run both jobs at once and wait for them
+        jobs = [
+            bq_utils.query_async(q)
+            for q in [drug_class_query, concept_ancestor_query]
+        ]
+        for _, results in jobs:
+            results.result()
 
     def table_has_clustering(self, table_info):
         clustering = table_info.get('clustering')
@@ -101,132 +95,100 @@ class ValidationMainTest(unittest.TestCase):
         tpe = time_partitioning.get('type')
         self.assertEqual(tpe, 'DAY')
 
-    def test_all_files_unparseable_output(self):
+    def test_unparseable_files_and_bad_file_names(self):
+        # one submission holds the unparseable cdm files and the unknown files
         # TODO possible bug: if no pre-existing table, results in bq table not found error
-        for cdm_table in common.SUBMISSION_FILES:
-            test_util.write_cloud_str(self.hpo_bucket,
-                                      self.folder_prefix + cdm_table, ".\n .")
-        bucket_items = gcs_utils.list_bucket(self.hpo_bucket)
-        folder_items = main.get_folder_items(bucket_items, self.folder_prefix)
-        expected_results = [(f, 1, 0, 0) for f in common.SUBMISSION_FILES]
-        r = main.validate_submission(self.hpo_id, self.hpo_bucket, folder_items,
-                                     self.folder_prefix)
-        self.assertSetEqual(set(expected_results), set(r['results']))
-
-    def test_bad_file_names(self):
         bad_file_names = [
             "avisit_occurrence.csv",
             "condition_occurence.csv",  # misspelled
             "person_final.csv",
             "procedure_occurrence.tsv"
         ]  # unsupported file extension
-        expected_warnings = []
-        for file_name in bad_file_names:
-            test_util.write_cloud_str(self.hpo_bucket,
-                                      self.folder_prefix + file_name, ".")
-            expected_item = (file_name, common.UNKNOWN_FILE)
-            expected_warnings.append(expected_item)
-        bucket_items = gcs_utils.list_bucket(self.hpo_bucket)
+        items = [(self.folder_prefix + cdm_table, ".\n .")
+                 for cdm_table in common.SUBMISSION_FILES]
+        items.extend((self.folder_prefix + file_name, ".")
+                     for file_name in bad_file_names)
+        test_util.write_cloud_batch(self.hpo_bucket, items)
+        bucket_items = gcs_utils.list_bucket(self.hpo_bucket,
+                                             prefix=self.folder_prefix)
         folder_items = main.get_folder_items(bucket_items, self.folder_prefix)
         r = main.validate_submission(self.hpo_id, self.hpo_bucket, folder_items,
                                      self.folder_prefix)
-        self.assertCountEqual(expected_warnings, r['warnings'])
+
+        with self.subTest('all files unparseable'):
+            expected_results = [(f, 1, 0, 0) for f in common.SUBMISSION_FILES]
+            self.assertSetEqual(set(expected_results), set(r['results']))
+
+        with self.subTest('bad file names'):
+            expected_warnings = [
+                (file_name, common.UNKNOWN_FILE) for file_name in bad_file_names
+            ]
+            self.assertCountEqual(expected_warnings, r['warnings'])
 
     @mock.patch('api_util.check_cron')
     def test_validate_five_persons_success(self, mock_check_cron):
-        expected_results = []
-        test_file_names = [
+        test_file_names = {
             os.path.basename(f) for f in test_util.FIVE_PERSONS_FILES
-        ]
-
+        }
+        expected_results = []
         for cdm_file in common.SUBMISSION_FILES:
-            if cdm_file in test_file_names:
-                expected_result = (cdm_file, 1, 1, 1)
-                test_file = os.path.join(test_util.FIVE_PERSONS_PATH, cdm_file)
-                test_util.write_cloud_file(self.hpo_bucket,
-                                           test_file,
-                                           prefix=self.folder_prefix)
-            else:
-                expected_result = (cdm_file, 0, 0, 0)
-            expected_results.append(expected_result)
-        bucket_items = gcs_utils.list_bucket(self.hpo_bucket)
+            result = 1 if cdm_file in test_file_names else 0
+            expected_results.append((cdm_file, result, result, result))
+        test_files = [
+            os.path.join(test_util.FIVE_PERSONS_PATH, cdm_file)
+            for cdm_file in common.SUBMISSION_FILES
+            if cdm_file in test_file_names
+        ]
+        test_util.write_cloud_batch(
+            self.hpo_bucket,
+            test_util.get_cloud_file_items(test_files,
+                                           prefix=self.folder_prefix))
+        bucket_items = gcs_utils.list_bucket(self.hpo_bucket,
+                                             prefix=self.folder_prefix)
         folder_items = main.get_folder_items(bucket_items, self.folder_prefix)
         r = main.validate_submission(self.hpo_id, self.hpo_bucket, folder_items,
                                      self.folder_prefix)
         self.assertSetEqual(set(r['results']), set(expected_results))
 
         # check tables exist and are clustered as expected
-        for table in resources.CDM_TABLES + common.PII_TABLES:
-            table_id = bq_utils.get_table_id(test_util.FAKE_HPO_ID, table)
-            table_info = bq_utils.get_table_info(table_id)
+        tables = resources.CDM_TABLES + common.PII_TABLES
+        table_ids = [
+            bq_utils.get_table_id(test_util.FAKE_HPO_ID, table)
+            for table in tables
+        ]
+        # the lookups are independent, fetch them concurrently
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            table_infos = list(executor.map(bq_utils.get_table_info, table_ids))
+        for table, table_info in zip(tables, table_infos):
             fields = resources.fields_for(table)
             field_names = [field['name'] for field in fields]
             if 'person_id' in field_names:
                 self.table_has_clustering(table_info)
 
-    def test_check_processed(self):
-        test_util.write_cloud_str(self.hpo_bucket,
-                                  self.folder_prefix + 'person.csv', '\n')
-        test_util.write_cloud_str(self.hpo_bucket,
-                                  self.folder_prefix + common.PROCESSED_TXT,
-                                  '\n')
-
-        bucket_items = gcs_utils.list_bucket(self.hpo_bucket)
-        result = main._get_submission_folder(self.hpo_bucket,
-                                             bucket_items,
-                                             force_process=False)
-        self.assertIsNone(result)
-        result = main._get_submission_folder(self.hpo_bucket,
-                                             bucket_items,
-                                             force_process=True)
-        self.assertEqual(result, self.folder_prefix)
-
     @mock.patch('api_util.check_cron')
     def test_copy_five_persons(self, mock_check_cron):
-        # upload all five_persons files
-        for cdm_file in test_util.FIVE_PERSONS_FILES:
-            test_util.write_cloud_file(self.hpo_bucket,
-                                       cdm_file,
-                                       prefix=self.folder_prefix)
-            test_util.write_cloud_file(self.hpo_bucket,
-                                       cdm_file,
-                                       prefix=self.folder_prefix +
-                                       self.folder_prefix)
-
-        main.app.testing = True
-        with main.app.test_client() as c:
-            c.get(test_util.COPY_HPO_FILES_URL)
-            prefix = test_util.FAKE_HPO_ID + '/' + self.hpo_bucket + '/' + self.folder_prefix
-            expected_bucket_items = [
-                prefix + item.split(os.sep)[-1]
-                for item in test_util.FIVE_PERSONS_FILES
-            ]
-            expected_bucket_items.extend([
-                prefix + self.folder_prefix + item.split(os.sep)[-1]
-                for item in test_util.FIVE_PERSONS_FILES
-            ])
-
-            list_bucket_result = gcs_utils.list_bucket(
-                gcs_utils.get_drc_bucket())
-            actual_bucket_items = [item['name'] for item in list_bucket_result]
-            self.assertSetEqual(set(expected_bucket_items),
-                                set(actual_bucket_items))
-
-    def test_target_bucket_upload(self):
-        bucket_nyc = gcs_utils.get_hpo_bucket('nyc')
-        folder_prefix = 'test-folder-fake/'
-        test_util.empty_bucket(bucket_nyc)
-
-        main._upload_achilles_files(hpo_id=None,
-                                    folder_prefix=folder_prefix,
-                                    target_bucket=bucket_nyc)
-        actual_bucket_files = set(
-            [item['name'] for item in gcs_utils.list_bucket(bucket_nyc)])
-        expected_bucket_files = set([
-            'test-folder-fake/' + item
-            for item in resources.ALL_ACHILLES_INDEX_FILES
+        # upload all five_persons files, then copy them within the bucket
+        items = test_util.get_cloud_file_items(test_util.FIVE_PERSONS_FILES,
+                                               prefix=self.folder_prefix)
+        test_util.write_cloud_batch(self.hpo_bucket, items)
+        test_util.copy_cloud_batch(
+            self.hpo_bucket,
+            [(name, self.folder_prefix + name) for name, _ in items])
+
+        self.client.get(test_util.COPY_HPO_FILES_URL)
+        prefix = test_util.FAKE_HPO_ID + '/' + self.hpo_bucket + '/' + self.folder_prefix
+        expected_bucket_items = [
+            prefix + item.split(os.sep)[-1]
+            for item in test_util.FIVE_PERSONS_FILES
+        ]
+        expected_bucket_items.extend([
+            prefix + self.folder_prefix + item.split(os.sep)[-1]
+            for item in test_util.FIVE_PERSONS_FILES
         ])
-        self.assertSetEqual(expected_bucket_files, actual_bucket_files)
+
+        actual_bucket_items = set(
+            item['name'] for item in gcs_utils.iter_bucket(self.drc_bucket))
+        self.assertSetEqual(set(expected_bucket_items), actual_bucket_items)
 
     @mock.patch('api_util.check_cron')
     def test_pii_files_loaded(self, mock_check_cron):
@@ -234,23 +196,21 @@ class ValidationMainTest(unittest.TestCase):
         test_file_paths = [
             test_util.PII_NAME_FILE, test_util.PII_MRN_BAD_PERSON_ID_FILE
         ]
-        test_file_names = [os.path.basename(f) for f in test_file_paths]
-        test_util.write_cloud_file(self.hpo_bucket,
-                                   test_util.PII_NAME_FILE,
-                                   prefix=self.folder_prefix)
-        test_util.write_cloud_file(self.hpo_bucket,
-                                   test_util.PII_MRN_BAD_PERSON_ID_FILE,
-                                   prefix=self.folder_prefix)
+        test_file_names = {os.path.basename(f) for f in test_file_paths}
+        test_util.write_cloud_batch(
+            self.hpo_bucket,
+            test_util.get_cloud_file_items(test_file_paths,
+                                           prefix=self.folder_prefix))
 
         rs = resources.csv_to_list(test_util.PII_FILE_LOAD_RESULT_CSV)
         expected_results = [(r['file_name'], int(r['found']), int(r['parsed']),
                              int(r['loaded'])) for r in rs]
-        for f in common.SUBMISSION_FILES:
-            if f not in test_file_names:
-                expected_result = (f, 0, 0, 0)
-                expected_results.append(expected_result)
+        expected_results.extend((f, 0, 0, 0)
+                                for f in common.SUBMISSION_FILES
+                                if f not in test_file_names)
 
-        bucket_items = gcs_utils.list_bucket(self.hpo_bucket)
+        bucket_items = gcs_utils.list_bucket(self.hpo_bucket,
+                                             prefix=self.folder_prefix)
         folder_items = main.get_folder_items(bucket_items, self.folder_prefix)
         r = main.validate_submission(self.hpo_id, self.hpo_bucket, folder_items,
                                      self.folder_prefix)
@@ -266,10 +226,10 @@ class ValidationMainTest(unittest.TestCase):
         mock_first_run.return_value = False
         rdr_date = '2020-01-01'
         mock_rdr_date.return_value = rdr_date
-        for cdm_file in test_util.FIVE_PERSONS_FILES:
-            test_util.write_cloud_file(self.hpo_bucket,
-                                       cdm_file,
-                                       prefix=self.folder_prefix)
+        test_util.write_cloud_batch(
+            self.hpo_bucket,
+            test_util.get_cloud_file_items(test_util.FIVE_PERSONS_FILES,
+                                           prefix=self.folder_prefix))
         # load person table in RDR
         bq_utils.load_table_from_csv(self.project_id, self.rdr_dataset_id,
                                      common.PERSON,
@@ -282,19 +242,21 @@ class ValidationMainTest(unittest.TestCase):
         required_labs.load_measurement_concept_sets_descendants_table(
             project_id=self.project_id, dataset_id=self.bigquery_dataset_id)
 
-        main.app.testing = True
-        with main.app.test_client() as c:
-            c.get(test_util.VALIDATE_HPO_FILES_URL)
-            actual_result = test_util.read_cloud_file(
-                self.hpo_bucket, self.folder_prefix + common.RESULTS_HTML)
+        self.client.get(test_util.VALIDATE_HPO_FILES_URL)
+        actual_result = test_util.read_cloud_file(
+            self.hpo_bucket, self.folder_prefix + common.RESULTS_HTML)
 
         # ensure emails are not sent
-        bucket_items = gcs_utils.list_bucket(self.hpo_bucket)
+        bucket_items = gcs_utils.list_bucket(self.hpo_bucket,
+                                             prefix=self.folder_prefix)
         folder_items = main.get_folder_items(bucket_items, self.folder_prefix)
         self.assertFalse(main.is_first_validation_run(folder_items))
 
         # parse html
-        soup = bs(actual_result, parser="lxml", features="lxml")
+        # only the tables checked below are parsed
+        report_tables = SoupStrainer('table',
+                                     id=['missing_pii', 'required-lab'])
+        soup = bs(actual_result, features="lxml", parse_only=report_tables)
         missing_pii_html_table = soup.find('table', id='missing_pii')
         table_headers = missing_pii_html_table.find_all('th')
         self.assertEqual('Missing Participant Record Type',
@@ -335,9 +297,28 @@ class ValidationMainTest(unittest.TestCase):
         self.assertTrue(len(submitted_labs) > 0)
         self.assertTrue(len(missing_labs) > 0)
 
+    @classmethod
+    def _clean_up_test_data(cls):
+        """
+        Empty the test buckets and drop the tables the tests create
+        """
+        # the clean up steps are independent, run them concurrently
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [
+                executor.submit(test_util.empty_bucket, cls.hpo_bucket),
+                executor.submit(test_util.empty_bucket, cls.nyc_bucket),
+                executor.submit(test_util.empty_bucket, cls.drc_bucket),
+                executor.submit(test_util.delete_all_tables,
+                                cls.bigquery_dataset_id,
+                                skip_tables=cls.SHARED_TABLES)
+            ]
+        # raise any failure of a clean up step
+        for future in futures:
+            future.result()
+
     def tearDown(self):
-        self._empty_bucket()
-        bucket_nyc = gcs_utils.get_hpo_bucket('nyc')
-        test_util.empty_bucket(bucket_nyc)
-        test_util.empty_bucket(gcs_utils.get_drc_bucket())
-        test_util.delete_all_tables(self.bigquery_dataset_id)
+        self._clean_up_test_data()
+
+    @classmethod
+    def tearDownClass(cls):
+        test_util.delete_all_tables(cls.bigquery_dataset_id)
@@ -1,8 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
 import inspect
 import os
-from io import open
+from io import BytesIO, open
 
+import cachetools
 import requests
+from googleapiclient.errors import HttpError
 
 import bq_utils
 import common
@@ -132,6 +135,10 @@ TEST_DATA_METRICS_PATH = os.path.join(TEST_DATA_PATH, 'metrics')
 TEST_NYC_CU_COLS_CSV = os.path.join(TEST_DATA_METRICS_PATH, 'nyc_cu_cols.csv')
 TEST_MEASUREMENT_CSV = os.path.join(TEST_DATA_METRICS_PATH, 'measurement.csv')
 
+GCS_MAX_WORKERS = 32
+# shared by the tests to issue independent GCS requests concurrently
+_GCS_POOL = ThreadPoolExecutor(max_workers=GCS_MAX_WORKERS)
+
 
 def _create_five_persons_success_result():
     """
@@ -193,26 +200,61 @@ def _export_query_responses():
 
 
 def empty_bucket(bucket):
-    bucket_items = gcs_utils.list_bucket(bucket)
-    for bucket_item in bucket_items:
-        gcs_utils.delete_object(bucket, bucket_item['name'])
+    """
+    Delete all objects in a bucket
 
+    The deletes are independent so they are issued concurrently.
 
-def delete_all_tables(dataset_id):
+    :param bucket: name of the bucket
+    """
+    # collect the names before deleting so the listing pages are not disturbed
+    names = [
+        bucket_item['name'] for bucket_item in gcs_utils.iter_bucket(bucket)
+    ]
+
+    def delete(name):
+        return gcs_utils.delete_object(bucket, name)
+
+    # consume the results so any failed delete is raised here
+    list(_GCS_POOL.map(delete, names))
+
+
+def delete_all_tables(dataset_id, skip_tables=None):
     """
     Remove all non-vocabulary tables from a dataset
 
     :param dataset_id: ID of the dataset with the tables to delete
+    :param skip_tables: optional list of other tables to keep
     :return: list of deleted tables
     """
+    keep_tables = set(common.VOCABULARY_TABLES)
+    if skip_tables:
+        keep_tables.update(skip_tables)
 
-    deleted = []
-    table_infos = bq_utils.list_tables(dataset_id)
-    table_ids = [table['tableReference']['tableId'] for table in table_infos]
-    for table_id in table_ids:
-        if table_id not in common.VOCABULARY_TABLES:
-            bq_utils.delete_table(table_id, dataset_id)
-            deleted.append(table_id)
+    table_infos = [
+        table for table in bq_utils.list_tables(dataset_id)
+        if table['tableReference']['tableId'] not in keep_tables
+    ]
+    deleted = [table['tableReference']['tableId'] for table in table_infos]
+    if not table_infos:
+        return deleted
+
+    # drop the tables in a single script job rather than one request per table
+    statements = []
+    for table in table_infos:
+        table_ref = table['tableReference']
+        kind = 'VIEW' if table.get('type') == 'VIEW' else 'TABLE'
+        statements.append(f"DROP {kind} IF EXISTS `{table_ref['projectId']}."
+                          f"{table_ref['datasetId']}.{table_ref['tableId']}`;")
+    try:
+        _, results = bq_utils.query_async('\n'.join(statements))
+        # wait for the script to finish, a failed or stuck job raises here
+        results.result()
+    except (HttpError, bq_utils.BigQueryJobWaitError):
+        # fall back to deleting the remaining tables one at a time
+        for table_id in deleted:
+            if bq_utils.table_exists(table_id, dataset_id):
+                bq_utils.delete_table(table_id, dataset_id)
     return deleted
 
 
@@ -271,14 +313,76 @@ def write_cloud_str(bucket, name, contents_str):
 
 def write_cloud_file(bucket, f, prefix=""):
     name = os.path.basename(f)
-    with open(f, 'rb') as fp:
-        return write_cloud_fp(bucket, prefix + name, fp)
+    return write_cloud_fp(bucket, prefix + name, BytesIO(read_file_bytes(f)))
 
 
 def write_cloud_fp(bucket, name, fp):
     return gcs_utils.upload_object(bucket, name, fp)
 
 
+@cachetools.cached(cache={})
+def read_file_bytes(path):
+    """
+    Read the contents of a local test file
+
+    The test data files do not change during a run, so each file is read
+    once and its contents are reused.
+
+    :param path: path to the file
+    :return: the file contents as bytes
+    """
+    with open(path, 'rb') as fp:
+        return fp.read()
+
+
+def get_cloud_file_items(files, prefix=""):
+    """
+    Read local files into items to upload with `write_cloud_batch`
+
+    :param files: paths of the local files
+    :param prefix: prefix prepended to each file's name in the bucket
+    :return: list of (name, contents) tuples
+    """
+    return [(prefix + os.path.basename(f), read_file_bytes(f)) for f in files]
+
+
+def write_cloud_batch(bucket, items):
+    """
+    Upload several objects to a bucket concurrently
+
+    :param bucket: name of the bucket
+    :param items: list of (name, contents) tuples where contents is str or bytes
+    :return: list of metadata about the uploaded files
+    """
+
+    def upload(item):
+        name, contents = item
+        if isinstance(contents, bytes):
+            return write_cloud_fp(bucket, name, BytesIO(contents))
+        return write_cloud_str(bucket, name, contents)
+
+    return list(_GCS_POOL.map(upload, items))
+
+
+def copy_cloud_batch(bucket, names):
+    """
+    Copy several objects within a bucket concurrently
+
+    The copies are done by GCS, so the contents are not uploaded again.
+
+    :param bucket: name of the bucket
+    :param names: list of (source name, destination name) tuples
+    :return: list of responses of the copy requests
+    """
+
+    def copy(name_pair):
+        source_name, destination_name = name_pair
+        return gcs_utils.copy_object(bucket, source_name, bucket,
+                                     destination_name)
+
+    return list(_GCS_POOL.map(copy, names))
+
+
 def populate_achilles(hpo_bucket, hpo_id=FAKE_HPO_ID, include_heel=True):
     from validation import achilles, achilles_heel
     import app_identity
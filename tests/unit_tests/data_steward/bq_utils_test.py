@@ -1,7 +1,9 @@
+import collections
 import unittest
 from datetime import datetime
 
 import mock
+from googleapiclient.errors import HttpError
 
 import bq_utils
 from constants import bq_utils as bq_utils_consts
@@ -17,60 +19,230 @@ class BqUtilsTest(unittest.TestCase):
 
     def setUp(self):
         self.hpo_id = 'fake-hpo'
+        self.project_id = 'fake-project'
+        self.dataset_id = 'fake_dataset'
+        bq_utils._TABLE_INFO_CACHE.clear()
+
+        self.get_application_id_patcher = mock.patch(
+            'bq_utils.app_identity.get_application_id')
+        self.mock_get_application_id = self.get_application_id_patcher.start()
+        self.mock_get_application_id.return_value = self.project_id
+        self.addCleanup(self.get_application_id_patcher.stop)
 
     def test_load_cdm_csv_error_on_bad_table_name(self):
         self.assertRaises(ValueError, bq_utils.load_cdm_csv, self.hpo_id,
                           'not_a_cdm_table')
 
-    @mock.patch('bq_utils.job_status_done', lambda x: True)
-    def test_wait_on_jobs_already_done(self):
+    @staticmethod
+    def _done_after(polls_by_job):
+        """
+        Get a stand-in for `_wait_one` reporting each job done after a number of polls
+
+        :param polls_by_job: dict mapping job_id -> number of polls until done,
+            or None if the job never completes
+        """
+        polls = collections.Counter()
+
+        def wait_one(job_id, timeout_ms, project_id):
+            polls[job_id] += 1
+            required = polls_by_job[job_id]
+            return required is not None and polls[job_id] >= required
+
+        return wait_one
+
+    @staticmethod
+    def _running_query_jobs(job_ids, project_id):
+        return {
+            job_id: {
+                'configuration': {
+                    'query': {}
+                },
+                'status': {
+                    'state': 'RUNNING'
+                }
+            } for job_id in job_ids
+        }
+
+    @mock.patch('bq_utils._get_jobs')
+    @mock.patch('bq_utils._wait_one')
+    def test_wait_on_jobs_already_done(self, mock_wait_one, mock_get_jobs):
         job_ids = range(3)
+        mock_get_jobs.side_effect = lambda job_ids, project_id: {
+            job_id: {
+                'status': {
+                    'state': 'DONE'
+                }
+            } for job_id in job_ids
+        }
         actual = bq_utils.wait_on_jobs(job_ids)
         expected = []
         self.assertEqual(actual, expected)
+        mock_get_jobs.assert_called_once_with(list(job_ids), self.project_id)
+        mock_wait_one.assert_not_called()
 
-    @mock.patch('time.sleep', return_value=None)
-    @mock.patch('bq_utils.job_status_done', return_value=False)
-    def test_wait_on_jobs_all_fail(self, mock_job_status_done, mock_time_sleep):
+    @mock.patch('bq_utils.sleeper')
+    @mock.patch('bq_utils._get_jobs')
+    @mock.patch('bq_utils._wait_one', return_value=False)
+    def test_wait_on_jobs_all_fail(self, mock_wait_one, mock_get_jobs,
+                                   mock_sleep):
         job_ids = list(range(3))
+        mock_get_jobs.side_effect = self._running_query_jobs
         actual = bq_utils.wait_on_jobs(job_ids)
         expected = job_ids
         self.assertEqual(actual, expected)
-        # TODO figure out how to count this
-        # self.assertEquals(mock_time_sleep.call_count, bq_utils.BQ_DEFAULT_RETRY_COUNT)
-
-    @mock.patch('time.sleep', return_value=None)
-    @mock.patch(
-        'bq_utils.job_status_done',
-        side_effect=[False, False, False, True, False, False, True, True, True])
-    def test_wait_on_jobs_get_done(self, mock_job_status_done, mock_time_sleep):
+        self.assertEqual(mock_get_jobs.call_count,
+                         bq_utils_consts.BQ_DEFAULT_RETRY_COUNT + 1)
+        self.assertEqual(
+            mock_wait_one.call_count,
+            len(job_ids) * (bq_utils_consts.BQ_DEFAULT_RETRY_COUNT + 1))
+        self.assertEqual(mock_sleep.call_count,
+                         bq_utils_consts.BQ_DEFAULT_RETRY_COUNT)
+        for call in mock_wait_one.call_args_list:
+            self.assertEqual(
+                call[1], {
+                    'timeout_ms': bq_utils_consts.JOB_WAIT_TIMEOUT_MS,
+                    'project_id': self.project_id
+                })
+        self.mock_get_application_id.assert_called_once_with()
+
+    @mock.patch('bq_utils.sleeper')
+    @mock.patch('bq_utils._get_jobs')
+    @mock.patch('bq_utils._wait_one')
+    def test_wait_on_jobs_get_done(self, mock_wait_one, mock_get_jobs,
+                                   mock_sleep):
         job_ids = list(range(3))
+        mock_get_jobs.side_effect = self._running_query_jobs
+        mock_wait_one.side_effect = self._done_after({0: 2, 1: 3, 2: 3})
         actual = bq_utils.wait_on_jobs(job_ids)
         expected = []
         self.assertEqual(actual, expected)
+        self.assertEqual(mock_sleep.call_count, 2)
 
-    @mock.patch('time.sleep', return_value=None)
-    @mock.patch('bq_utils.job_status_done',
-                side_effect=[
-                    False, False, True, False, False, False, False, False,
-                    False, False, False, False
-                ])
-    def test_wait_on_jobs_some_fail(self, mock_job_status_done,
-                                    mock_time_sleep):
+    @mock.patch('bq_utils.sleeper')
+    @mock.patch('bq_utils._get_jobs')
+    @mock.patch('bq_utils._wait_one')
+    def test_wait_on_jobs_some_fail(self, mock_wait_one, mock_get_jobs,
+                                    mock_sleep):
         job_ids = list(range(2))
+        mock_get_jobs.side_effect = self._running_query_jobs
+        mock_wait_one.side_effect = self._done_after({0: 2, 1: None})
         actual = bq_utils.wait_on_jobs(job_ids)
         expected = [1]
         self.assertEqual(actual, expected)
 
     @mock.patch('bq_utils.sleeper')
-    @mock.patch('bq_utils.job_status_done')
-    def test_wait_on_jobs_retry_count(self, mock_job_status, mock_sleep):
-        max_sleep_interval = 512
-        mock_job_status.return_value = False
+    @mock.patch('bq_utils._get_jobs')
+    @mock.patch('bq_utils._wait_one')
+    def test_wait_on_jobs_load_job(self, mock_wait_one, mock_get_jobs,
+                                   mock_sleep):
+        mock_get_jobs.side_effect = [{
+            'job_1': {
+                'configuration': {
+                    'load': {}
+                },
+                'status': {
+                    'state': 'RUNNING'
+                }
+            }
+        }, {
+            'job_1': {
+                'configuration': {
+                    'load': {}
+                },
+                'status': {
+                    'state': 'DONE'
+                }
+            }
+        }]
+        actual = bq_utils.wait_on_jobs(['job_1'])
+        self.assertEqual(actual, [])
+        mock_wait_one.assert_not_called()
+        mock_sleep.assert_called_once_with(1)
+
+    @mock.patch('bq_utils.sleeper')
+    @mock.patch('bq_utils._get_jobs')
+    @mock.patch('bq_utils._wait_one')
+    def test_wait_on_jobs_retry_count(self, mock_wait_one, mock_get_jobs,
+                                      mock_sleep):
+        max_sleep_interval = bq_utils_consts.MAX_POLL_INTERVAL
+        mock_get_jobs.side_effect = self._running_query_jobs
+        mock_wait_one.return_value = False
         job_ids = ["job_1", "job_2"]
         bq_utils.wait_on_jobs(job_ids)
         mock_sleep.assert_called_with(max_sleep_interval)
 
+    @mock.patch('bq_utils.sleeper')
+    @mock.patch('bq_utils._get_jobs')
+    @mock.patch('bq_utils._wait_one')
+    def test_wait_on_jobs_max_poll_interval(self, mock_wait_one, mock_get_jobs,
+                                            mock_sleep):
+        mock_get_jobs.side_effect = self._running_query_jobs
+        mock_wait_one.return_value = False
+        bq_utils.wait_on_jobs(["job_1"], retry_count=12)
+        intervals = [args[0] for args, _ in mock_sleep.call_args_list]
+        self.assertEqual(intervals[-4:], [256, 500, 500, 500])
+
+    @mock.patch('bq_utils.create_service')
+    def test_get_jobs(self, mock_create_service):
+        mock_service = mock_create_service.return_value
+        job_ids = ['job_1', 'job_2']
+        responses = {'0': {'id': 'job_1'}}
+        exceptions = {'1': HttpError(mock.Mock(status=500), b'Error')}
+
+        def new_batch_http_request(callback):
+            mock_batch = mock.MagicMock()
+            request_ids = []
+            mock_batch.add.side_effect = lambda request, request_id: request_ids.append(
+                request_id)
+            mock_batch.execute.side_effect = lambda: [
+                callback(request_id, responses.get(request_id),
+                         exceptions.get(request_id))
+                for request_id in request_ids
+            ]
+            return mock_batch
+
+        mock_service.new_batch_http_request.side_effect = new_batch_http_request
+
+        actual = bq_utils._get_jobs(job_ids)
+
+        self.assertEqual(actual, {'job_1': {'id': 'job_1'}})
+        mock_service.new_batch_http_request.assert_called_once()
+        mock_service.jobs.return_value.get.assert_has_calls([
+            mock.call(projectId=self.project_id, jobId='job_1'),
+            mock.call(projectId=self.project_id, jobId='job_2')
+        ])
+
+    @mock.patch('bq_utils.app_identity.get_application_id')
+    @mock.patch('bq_utils.create_service')
+    def test_wait_one(self, mock_create_service, mock_get_application_id):
+        mock_get_application_id.return_value = self.project_id
+        mock_get_query_results = mock_create_service.return_value.jobs.return_value.getQueryResults
+        mock_get_query_results.return_value.execute.return_value = {
+            'jobComplete': True
+        }
+
+        self.assertTrue(bq_utils._wait_one('job_1', timeout_ms=100))
+        mock_get_query_results.assert_called_once_with(
+            projectId=self.project_id,
+            jobId='job_1',
+            timeoutMs=100,
+            maxResults=0)
+
+    @mock.patch('bq_utils.job_status_done')
+    @mock.patch('bq_utils.app_identity.get_application_id')
+    @mock.patch('bq_utils.create_service')
+    def test_wait_one_not_a_query_job(self, mock_create_service,
+                                      mock_get_application_id,
+                                      mock_job_status_done):
+        mock_get_application_id.return_value = self.project_id
+        mock_get_query_results = mock_create_service.return_value.jobs.return_value.getQueryResults
+        mock_get_query_results.return_value.execute.side_effect = HttpError(
+            mock.Mock(status=400), b'Not a query job')
+        mock_job_status_done.return_value = True
+
+        self.assertTrue(bq_utils._wait_one('job_1'))
+        mock_job_status_done.assert_called_once_with('job_1')
+
     @mock.patch('bq_utils.os.environ.get')
     def test_get_validation_results_dataset_id_not_existing(self, mock_env_var):
         # preconditions
@@ -95,3 +267,314 @@ class BqUtilsTest(unittest.TestCase):
         # post conditions
         expected = 'dataset_foo'
         self.assertEqual(result_id, expected)
+
+    @mock.patch('bq_utils._get_table_info_uncached')
+    def test_get_table_info_cached(self, mock_get_table_info_uncached):
+        table_info = {'id': 'fake_table'}
+        mock_get_table_info_uncached.return_value = table_info
+
+        first = bq_utils.get_table_info('fake_table', self.dataset_id,
+                                        self.project_id)
+        second = bq_utils.get_table_info('fake_table', self.dataset_id,
+                                         self.project_id)
+
+        self.assertEqual(first, table_info)
+        self.assertEqual(second, table_info)
+        mock_get_table_info_uncached.assert_called_once_with(
+            self.project_id, self.dataset_id, 'fake_table')
+
+        bq_utils.invalidate_table_info('fake_table', self.dataset_id,
+                                       self.project_id)
+        bq_utils.get_table_info('fake_table', self.dataset_id, self.project_id)
+        self.assertEqual(mock_get_table_info_uncached.call_count, 2)
+
+    @mock.patch('bq_utils.app_identity.get_application_id')
+    @mock.patch('bq_utils._get_table_info_uncached')
+    def test_table_exists_missing_table(self, mock_get_table_info_uncached,
+                                        mock_get_application_id):
+        mock_get_application_id.return_value = self.project_id
+        mock_get_table_info_uncached.side_effect = [
+            HttpError(mock.Mock(status=404), b'Not found'), {
+                'id': 'fake_table'
+            }
+        ]
+
+        self.assertFalse(bq_utils.table_exists('fake_table', self.dataset_id))
+        # a missing table is not cached, so its creation is seen right away
+        self.assertTrue(bq_utils.table_exists('fake_table', self.dataset_id))
+        self.assertEqual(mock_get_table_info_uncached.call_count, 2)
+        self.assertTrue(bq_utils.table_exists('fake_table', self.dataset_id))
+        self.assertEqual(mock_get_table_info_uncached.call_count, 2)
+
+    @mock.patch('bq_utils._get_table_info_uncached')
+    def test_table_exists_uses_table_info(self, mock_get_table_info_uncached):
+        mock_get_table_info_uncached.return_value = {'id': 'fake_table'}
+
+        bq_utils.get_table_info('fake_table', self.dataset_id)
+        self.assertTrue(bq_utils.table_exists('fake_table', self.dataset_id))
+        mock_get_table_info_uncached.assert_called_once_with(
+            self.project_id, self.dataset_id, 'fake_table')
+
+    def _cache_table_info(self, table_id, dataset_id=None):
+        key = (self.project_id, dataset_id or self.dataset_id, table_id)
+        bq_utils._TABLE_INFO_CACHE[key] = {'id': table_id}
+        return key
+
+    @mock.patch('bq_utils._get_jobs')
+    @mock.patch('bq_utils._wait_one')
+    def test_wait_on_jobs_invalidates_destination(self, mock_wait_one,
+                                                  mock_get_jobs):
+        person_key = self._cache_table_info('fake_person')
+        visit_key = self._cache_table_info('fake_visit')
+        mock_get_jobs.return_value = {
+            'job_1': {
+                'configuration': {
+                    'load': {
+                        'destinationTable': {
+                            'projectId': self.project_id,
+                            'datasetId': self.dataset_id,
+                            'tableId': 'fake_person'
+                        }
+                    }
+                },
+                'status': {
+                    'state': 'DONE'
+                }
+            }
+        }
+
+        self.assertEqual(bq_utils.wait_on_jobs(['job_1']), [])
+        self.assertNotIn(person_key, bq_utils._TABLE_INFO_CACHE)
+        self.assertIn(visit_key, bq_utils._TABLE_INFO_CACHE)
+
+    @mock.patch('bq_utils.get_dataset_id')
+    @mock.patch('bq_utils.create_service')
+    def test_query_async_invalidates_on_completion(self, mock_create_service,
+                                                   mock_get_dataset_id):
+        mock_get_dataset_id.return_value = self.dataset_id
+        mock_jobs = mock_create_service.return_value.jobs.return_value
+        mock_jobs.insert.return_value.execute.return_value = {
+            'jobReference': {
+                'jobId': 'job_1'
+            }
+        }
+        mock_jobs.getQueryResults.return_value.execute.return_value = {
+            'jobComplete': True
+        }
+        key = self._cache_table_info('fake_table')
+
+        _, future = bq_utils.query_async('SELECT * FROM fake_table')
+        future.result()
+        self.assertIn(key, bq_utils._TABLE_INFO_CACHE)
+
+        # DDL does not name the tables it changes as destination
+        _, future = bq_utils.query_async('DROP TABLE IF EXISTS fake_table')
+        future.result()
+        self.assertNotIn(key, bq_utils._TABLE_INFO_CACHE)
+
+    @mock.patch('bq_utils.create_service')
+    def test_create_dataset_invalidates_dataset(self, mock_create_service):
+        mock_datasets = mock_create_service.return_value.datasets.return_value
+        mock_datasets.insert.return_value.execute.side_effect = [
+            HttpError(mock.Mock(status=409), b'Already exists'), {}
+        ]
+        key = self._cache_table_info('fake_table')
+        other_key = self._cache_table_info('fake_table', 'other_dataset')
+
+        bq_utils.create_dataset(dataset_id=self.dataset_id,
+                                description='fake dataset')
+
+        mock_datasets.delete.assert_called_once_with(
+            projectId=self.project_id,
+            datasetId=self.dataset_id,
+            deleteContents=bq_utils_consts.TRUE)
+        self.assertNotIn(key, bq_utils._TABLE_INFO_CACHE)
+        self.assertIn(other_key, bq_utils._TABLE_INFO_CACHE)
+
+    @mock.patch('bq_utils._get_query_results_page')
+    @mock.patch('bq_utils.app_identity.get_application_id')
+    def test_large_response_to_rowlist(self, mock_get_application_id,
+                                       mock_get_query_results_page):
+        mock_get_application_id.return_value = self.project_id
+        schema = {'fields': [{'name': 'person_id', 'type': 'INTEGER'}]}
+        first_page = {
+            'jobReference': {
+                'jobId': 'job_1'
+            },
+            'schema': schema,
+            'rows': [{
+                'f': [{
+                    'v': '1'
+                }]
+            }],
+            'pageToken': 'token_2'
+        }
+        second_page = {'schema': schema, 'rows': [{'f': [{'v': '2'}]}]}
+        mock_get_query_results_page.return_value = second_page
+
+        actual = bq_utils.large_response_to_rowlist(first_page)
+
+        self.assertEqual(actual, [{'person_id': 1}, {'person_id': 2}])
+        mock_get_query_results_page.assert_called_once_with(
+            self.project_id, 'job_1', 'token_2')
+
+    def test_response2rows(self):
+        response = {
+            'schema': {
+                'fields': [{
+                    'name': 'person_id',
+                    'type': 'INTEGER'
+                }, {
+                    'name': 'is_active',
+                    'type': 'BOOLEAN'
+                }, {
+                    'name': 'name',
+                    'type': 'STRING'
+                }, {
+                    'name': 'visits',
+                    'type': 'RECORD',
+                    'mode': 'REPEATED',
+                    'fields': [{
+                        'name': 'visit_id',
+                        'type': 'INTEGER'
+                    }]
+                }]
+            },
+            'rows': [{
+                'f': [{
+                    'v': '1'
+                }, {
+                    'v': 'true'
+                }, {
+                    'v': None
+                }, {
+                    'v': [{
+                        'v': {
+                            'f': [{
+                                'v': '10'
+                            }]
+                        }
+                    }, {
+                        'v': {
+                            'f': [{
+                                'v': '11'
+                            }]
+                        }
+                    }]
+                }]
+            }]
+        }
+        expected = [{
+            'person_id': 1,
+            'is_active': True,
+            'name': None,
+            'visits': [{
+                'visit_id': 10
+            }, {
+                'visit_id': 11
+            }]
+        }]
+        self.assertEqual(bq_utils.response2rows(response), expected)
+        self.assertEqual(bq_utils.response2rows({}), [])
+
+    @mock.patch('bq_utils.get_dataset_id')
+    @mock.patch('bq_utils.app_identity.get_application_id')
+    @mock.patch('bq_utils.create_service')
+    def test_query_async(self, mock_create_service, mock_get_application_id,
+                         mock_get_dataset_id):
+        mock_get_application_id.return_value = self.project_id
+        mock_get_dataset_id.return_value = self.dataset_id
+        mock_jobs = mock_create_service.return_value.jobs.return_value
+        mock_jobs.insert.return_value.execute.return_value = {
+            'jobReference': {
+                'jobId': 'job_1'
+            }
+        }
+        results = {'jobComplete': True, 'rows': []}
+        mock_jobs.getQueryResults.return_value.execute.side_effect = [{
+            'jobComplete': False
+        }, results]
+
+        job_id, future = bq_utils.query_async('SELECT 1', batch=True)
+
+        self.assertEqual(job_id, 'job_1')
+        self.assertEqual(future.result(), results)
+        job_body = mock_jobs.insert.call_args[1]['body']
+        self.assertEqual(job_body['configuration']['query']['priority'],
+                         bq_utils_consts.BATCH)
+        self.assertEqual(mock_jobs.getQueryResults.call_count, 2)
+
+    @mock.patch('bq_utils.time.monotonic')
+    @mock.patch('bq_utils.create_service')
+    def test_get_query_results_max_wait(self, mock_create_service,
+                                        mock_monotonic):
+        mock_get_query_results = mock_create_service.return_value.jobs.return_value.getQueryResults
+        mock_get_query_results.return_value.execute.return_value = {
+            'jobComplete': False
+        }
+        mock_monotonic.side_effect = [0.0, 0.0, 0.5, 1.0]
+
+        self.assertRaises(bq_utils.BigQueryJobWaitError,
+                          bq_utils._get_query_results,
+                          'job_1',
+                          timeout_ms=800,
+                          max_wait_ms=1000)
+        # each request waits no longer than the time left
+        timeouts = [
+            kwargs['timeoutMs']
+            for _, kwargs in mock_get_query_results.call_args_list
+        ]
+        self.assertEqual(timeouts, [800, 500])
+
+    @mock.patch('bq_utils.resources.fields_for')
+    @mock.patch('bq_utils.create_service')
+    def test_load_csv(self, mock_create_service, mock_fields_for):
+        fields = [{'name': 'person_id', 'type': 'integer'}]
+        mock_fields_for.return_value = fields
+        mock_insert = mock_create_service.return_value.jobs.return_value.insert
+
+        bq_utils.load_csv('person',
+                          'gs://fake-bucket/person.csv',
+                          self.project_id,
+                          self.dataset_id,
+                          'fake_person',
+                          write_disposition=bq_utils_consts.WRITE_APPEND)
+
+        load = mock_insert.call_args[1]['body']['configuration']['load']
+        self.assertEqual(load['writeDisposition'], bq_utils_consts.WRITE_APPEND)
+        self.assertEqual(load['sourceFormat'], 'CSV')
+        self.assertEqual(load['skipLeadingRows'], 1)
+        self.assertEqual(load['schema'], {'fields': fields})
+        self.assertEqual(
+            load['destinationTable'], {
+                'projectId': self.project_id,
+                'datasetId': self.dataset_id,
+                'tableId': 'fake_person'
+            })
+
+    @mock.patch('bq_utils.sleeper')
+    @mock.patch('bq_utils.get_job_details')
+    def test_job_status_done_retries(self, mock_get_job_details, mock_sleep):
+        unavailable = HttpError(mock.Mock(status=503), b'Unavailable')
+        mock_get_job_details.side_effect = [
+            unavailable, unavailable, {
+                'status': {
+                    'state': 'DONE'
+                }
+            }
+        ]
+        self.assertTrue(bq_utils.job_status_done('job_1'))
+        self.assertEqual(mock_get_job_details.call_count, 3)
+        mock_sleep.assert_has_calls([mock.call(1), mock.call(2)])
+
+        mock_get_job_details.reset_mock()
+        mock_get_job_details.side_effect = unavailable
+        self.assertRaises(HttpError, bq_utils.job_status_done, 'job_1')
+        self.assertEqual(mock_get_job_details.call_count,
+                         bq_utils_consts.JOB_STATUS_MAX_RETRIES + 1)
+
+        mock_get_job_details.reset_mock()
+        mock_get_job_details.side_effect = HttpError(mock.Mock(status=404),
+                                                     b'Not found')
+        self.assertRaises(HttpError, bq_utils.job_status_done, 'job_1')
+        mock_get_job_details.assert_called_once_with('job_1')
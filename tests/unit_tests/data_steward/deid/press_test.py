@@ -5,6 +5,7 @@ import unittest
 from mock import patch
 
 # Project imports
+from deid import press
 from deid.press import Press
 
 
@@ -39,6 +40,11 @@ class PressTest(unittest.TestCase):
         self.mock_open_file.side_effect = [[], OSError]
         self.addCleanup(mock_open.stop)
 
+        mock_mtime = patch('deid.press.os.path.getmtime')
+        mock_mtime.start()
+        self.addCleanup(mock_mtime.stop)
+        press._RULES_CACHE.clear()
+
         mock_json = patch('deid.press.json.loads')
         self.mock_read_json = mock_json.start()
         self.mock_read_json.side_effect = [[], []]
@@ -90,3 +96,52 @@ class PressTest(unittest.TestCase):
         # post conditions
         expected = ['delete * from ' + table_path]
         self.assertEqual(result, expected)
+
+    @patch('deid.press.bq_utils.get_table_info')
+    def test_get_table_columns(self, mock_get_table_info):
+        # pre-conditions
+        mock_get_table_info.return_value = {
+            'schema': {
+                'fields': [{
+                    'name': 'person_id'
+                }, {
+                    'name': 'birth_datetime'
+                }]
+            }
+        }
+
+        # test
+        result = self.press_obj.get_table_columns(self.tablename)
+        result.append('mutated')
+        repeated = self.press_obj.get_table_columns(self.tablename)
+
+        # post conditions
+        self.assertEqual(repeated, ['person_id', 'birth_datetime'])
+        mock_get_table_info.assert_called_once_with(
+            self.tablename, dataset_id=self.input_dataset)
+
+    def test_rules_loaded_once(self):
+        # pre-conditions
+        press._RULES_CACHE.clear()
+        self.mock_read_json.reset_mock()
+        self.mock_read_json.side_effect = [[{
+            '_id': 'suppress',
+            'FILTERS': []
+        }], OSError, OSError]
+
+        # test
+        first = BasePass(idataset=self.input_dataset,
+                         table=self.tablename,
+                         rules=self.rules_path)
+        first.deid_rules['suppress']['FILTERS'].append('mutated')
+        second = BasePass(idataset=self.input_dataset,
+                          table=self.tablename,
+                          rules=self.rules_path)
+
+        # post conditions
+        self.assertEqual(second.deid_rules['suppress'], {
+            '_id': 'suppress',
+            'FILTERS': []
+        })
+        # rules parsed once, table info tried for each instance
+        self.assertEqual(self.mock_read_json.call_count, 3)
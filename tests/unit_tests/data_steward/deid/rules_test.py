@@ -0,0 +1,277 @@
+# Python imports
+import unittest
+
+# Third party imports
+from mock import MagicMock
+
+# Project imports
+from deid import rules
+from deid.rules import Deid, Rules
+
+
+class RulesTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        print('**************************************************************')
+        print(cls.__name__)
+        print('**************************************************************')
+
+    def setUp(self):
+        self.parent = MagicMock()
+        self.parent.deid_rules = {'suppress': {'FILTERS': []}}
+        self.deid = Deid(pipeline=['suppress'], rules={}, parent=self.parent)
+
+    def test_suppress_rows(self):
+        # pre-conditions
+        args = {
+            'rules': [],
+            'label': 'suppress.ROWS',
+            'store': 'bigquery',
+            'tablename': 'foo_input.observation',
+            'on': "observation_source_value IN ('foo')"
+        }
+
+        # test
+        first = self.deid.suppress(**args)
+        second = self.deid.suppress(**args)
+
+        # post conditions
+        self.assertEqual(first, [])
+        self.assertEqual(second, [])
+        expected = [{
+            'filter': "observation_source_value NOT IN ('foo')",
+            'label': 'suppress.ROWS'
+        }]
+        self.assertEqual(self.deid.cache['suppress']['FILTERS'], expected)
+        self.assertEqual(self.parent.deid_rules['suppress']['FILTERS'],
+                         expected)
+
+    def test_suppress_regexp(self):
+        # pre-conditions
+        args = {
+            'rules': [{
+                'apply': 'REGEXP',
+                'values': ['^E8[0-4].*', '^V3.*']
+            }],
+            'label': 'suppress.ICD',
+            'store': 'bigquery',
+            'tablename': 'foo_input.condition_occurrence',
+            'on': 'condition_source_value',
+            'qualifier': 'IS FALSE'
+        }
+
+        # test
+        result = self.deid.suppress(**args)
+
+        # post conditions
+        self.assertEqual(result, [])
+        expected = [{
+            'filter': ("REGEXP_CONTAINS (LOWER(condition_source_value), "
+                       "LOWER('^E8[0-4].*|^V3.*')) IS FALSE"),
+            'label': 'suppress.ICD'
+        }]
+        self.assertEqual(self.deid.cache['suppress']['FILTERS'], expected)
+
+    def test_validate(self):
+        # pre-conditions
+        rules = Rules(rules={'generalize': {'RACE': []}})
+        filters = [{'filter': 'foo IS NULL'}]
+
+        # test and post conditions
+        self.assertTrue(
+            rules.validate('generalize', [{
+                'rules': '@generalize.RACE',
+                'into': 'other'
+            }], 'foo_input.person'))
+        self.assertFalse(
+            rules.validate('generalize', [{
+                'rules': '@generalize.SEX',
+                'into': 'other'
+            }], 'foo_input.person'))
+        self.assertFalse(
+            rules.validate('suppress', [{
+                'rules': '@generalize.RACE',
+                'into': 'other'
+            }], 'foo_input.person'))
+        self.assertTrue(rules.validate('suppress', filters, 'foo_input.person'))
+
+    def test_generalize(self):
+        # pre-conditions
+        rules = [{
+            'values': ['M'],
+            'into': 'male',
+            'qualifier': 'IN'
+        }, {
+            'values': ['F'],
+            'into': 'female',
+            'qualifier': 'IN'
+        }]
+
+        # test
+        result = self.deid.generalize(fields=['gender'],
+                                      label='generalize.GENDER',
+                                      rules=rules,
+                                      store='bigquery')
+
+        # post conditions
+        expected = [{
+            'name': 'gender',
+            'apply': ("CASE WHEN gender IN ('M') THEN 'male' "
+                      "WHEN gender IN ('F') THEN 'female' "
+                      "ELSE gender END AS gender"),
+            'label': 'generalize.GENDER'
+        }]
+        self.assertEqual(result, expected)
+
+    def test_get_values_string(self):
+        self.assertEqual(rules._get_values_string(['a', 'b']), "'a','b'")
+        self.assertEqual(rules._get_values_string([1, 2]), '1,2')
+        # equal values of different types are not served from the same entry
+        self.assertEqual(rules._get_values_string([1]), '1')
+        self.assertEqual(rules._get_values_string([1.0]), '1.0')
+        self.assertEqual(rules._get_values_string([True]), 'True')
+
+    def test_get_label_name(self):
+        self.assertEqual(rules._get_label_name('generalize.RACE'), 'RACE')
+        self.assertEqual(rules._get_label_name('suppress.ROWS.x'), 'ROWS.x')
+        self.assertEqual(rules._get_label_name('LABEL_UNSET'), 'LABEL_UNSET')
+        self.assertEqual(rules._get_label_name(None), '')
+
+    def test_generalize_regexp(self):
+        # pre-conditions
+        rules = [{
+            'apply': 'REGEXP',
+            'values': ['^E8[0-4].*', '^V3.*'],
+            'into': 'other'
+        }]
+
+        # test
+        result = self.deid.generalize(fields=['condition_source_value'],
+                                      label='generalize.ICD',
+                                      rules=rules,
+                                      store='bigquery')
+
+        # post conditions
+        self.assertEqual(
+            result[0]['apply'],
+            ("CASE WHEN REGEXP_CONTAINS (LOWER(condition_source_value), "
+             "LOWER('^E8[0-4].*|^V3.*'))  THEN 'other' "
+             "ELSE condition_source_value END AS condition_source_value"))
+
+    def test_generalize_count(self):
+        # pre-conditions
+        rules = [{
+            'apply': 'COUNT',
+            'values': [1585839, 1585840],
+            'on': [1585839, 1585840],
+            'qualifier': '> 1',
+            'into': 2000000002
+        }]
+
+        # test
+        result = self.deid.generalize(fields=['value_as_concept_id'],
+                                      label='generalize.GENDER',
+                                      rules=rules,
+                                      store='bigquery',
+                                      table='observation',
+                                      key_field='person_id',
+                                      value_field='observation.person_id',
+                                      dataset='foo_input',
+                                      alias='obs',
+                                      key_row='obs.:name')
+
+        # post conditions
+        self.assertEqual(
+            result[0]['apply'],
+            ("CASE WHEN ( SELECT COUNT (person_id) FROM foo_input.observation "
+             "AS obs WHERE person_id=observation.person_id AND "
+             "obs.value_as_concept_id IN (1585839,1585840) ) > 1 "
+             "THEN 2000000002 "
+             "ELSE value_as_concept_id END AS value_as_concept_id"))
+
+    def test_generalize_count_distinct(self):
+        # pre-conditions, :DISTINCT_FIELD must not be cut short by :FIELD
+        rules = [{
+            'apply': 'COUNT-DISTINCT',
+            'distinct': 'value_source_concept_id',
+            'values': [],
+            'qualifier': '> 1',
+            'into': 2000000008
+        }]
+
+        # test
+        result = self.deid.generalize(fields=['value_source_concept_id'],
+                                      label='generalize.RACE',
+                                      rules=rules,
+                                      store='bigquery',
+                                      table='observation',
+                                      key_field='person_id',
+                                      value_field='observation.person_id',
+                                      dataset='foo_input',
+                                      alias='obs')
+
+        # post conditions
+        self.assertEqual(
+            result[0]['apply'],
+            ("CASE WHEN ( SELECT COUNT (DISTINCT obs.value_source_concept_id) "
+             "FROM foo_input.observation AS obs "
+             "WHERE person_id=observation.person_id ) > 1 "
+             "THEN 2000000008 "
+             "ELSE value_source_concept_id END AS value_source_concept_id"))
+
+    def test_generalize_sql_statement(self):
+        # pre-conditions
+        rules = [{
+            'apply': 'SQL',
+            'statement': [
+                "(SELECT COUNT(obs.person_id) ",
+                "FROM :idataset.:table AS obs ",
+                "WHERE obs.person_id = :table.person_id ",
+                "AND :fields IS NOT NULL) "
+            ],
+            'qualifier': '> 1',
+            'into': 2000000008
+        }]
+
+        # test
+        result = self.deid.generalize(fields=['value_source_concept_id'],
+                                      label='generalize.RACE',
+                                      rules=rules,
+                                      store='bigquery',
+                                      table='observation')
+
+        # post conditions
+        self.assertEqual(
+            result[0]['apply'],
+            ("CASE WHEN (SELECT COUNT(obs.person_id)  "
+             "FROM :idataset.observation AS obs  "
+             "WHERE obs.person_id = observation.person_id  "
+             "AND value_source_concept_id IS NOT NULL)  > 1 "
+             "THEN 2000000008 "
+             "ELSE value_source_concept_id END AS value_source_concept_id"))
+
+    def test_compute(self):
+        # pre-conditions, :table is also the start of :table_id
+        rules = [
+            "(SELECT research_id FROM :idataset._deid_map ",
+            "WHERE :key_field = :value_field AND :table_id > 0) as :FIELD"
+        ]
+
+        # test
+        result = self.deid.compute(fields=['person_id'],
+                                   label='compute.id',
+                                   rules=rules,
+                                   table='map_user',
+                                   key_field='map_user.person_id',
+                                   value_field='person.person_id')
+
+        # post conditions
+        expected = [{
+            'apply': ("(SELECT research_id FROM :idataset._deid_map  "
+                      "WHERE map_user.person_id = person.person_id "
+                      "AND map_user_id > 0) as person_id"),
+            'name': 'person_id',
+            'label': 'compute.id'
+        }]
+        self.assertEqual(result, expected)
@@ -3,6 +3,7 @@ Unit test components of data_steward.validation.main
 """
 import datetime
 import re
+from io import BytesIO
 from unittest import TestCase, mock
 
 import googleapiclient.errors
@@ -12,6 +13,7 @@ import resources
 from constants.validation import hpo_report as report_consts
 from constants.validation import main as main_consts
 from constants.validation.participants import identity_match as id_match_consts
+from tests.gcs_test_helpers import FakeGcs
 from validation import main
 
 
@@ -576,3 +578,39 @@ class ValidationMainTest(TestCase):
 
             self.assertEqual(mock_run_export.call_count, 1)
             self.assertEqual(mock_upload_achilles_files.call_count, 1)
+
+    def test_check_processed(self):
+        fake_gcs = FakeGcs()
+        with fake_gcs.patch():
+            fake_gcs.upload_object(self.hpo_bucket,
+                                   self.folder_prefix + 'person.csv',
+                                   BytesIO(b'\n'))
+            fake_gcs.upload_object(self.hpo_bucket,
+                                   self.folder_prefix + common.PROCESSED_TXT,
+                                   BytesIO(b'\n'))
+
+            bucket_items = fake_gcs.list_bucket(self.hpo_bucket)
+            result = main._get_submission_folder(self.hpo_bucket,
+                                                 bucket_items,
+                                                 force_process=False)
+            self.assertIsNone(result)
+            result = main._get_submission_folder(self.hpo_bucket,
+                                                 bucket_items,
+                                                 force_process=True)
+            self.assertEqual(result, self.folder_prefix)
+
+    def test_target_bucket_upload(self):
+        bucket_nyc = 'fake_nyc_bucket'
+        folder_prefix = 'test-folder-fake/'
+        fake_gcs = FakeGcs()
+        with fake_gcs.patch():
+            main._upload_achilles_files(hpo_id=None,
+                                        folder_prefix=folder_prefix,
+                                        target_bucket=bucket_nyc)
+        actual_bucket_files = set(
+            [item['name'] for item in fake_gcs.list_bucket(bucket_nyc)])
+        expected_bucket_files = set([
+            'test-folder-fake/' + item
+            for item in resources.ALL_ACHILLES_INDEX_FILES
+        ])
+        self.assertSetEqual(expected_bucket_files, actual_bucket_files)